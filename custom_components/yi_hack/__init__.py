@@ -2,14 +2,16 @@
 
 import asyncio
 import logging
+import time
 
 from homeassistant.components import mqtt
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_HOST, CONF_MAC, CONF_NAME
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
 
-from .common import get_mqtt_conf, get_status, get_system_conf
+from .common import (LatencyStats, MotionImageBuffer, SnapshotCache,
+                     YiHackApi)
 from .const import (ALLWINNER, ALLWINNERV2, CONF_ANIMAL_DETECTION_MSG,
                     CONF_BABY_CRYING_MSG, CONF_BIRTH_MSG, CONF_HACK_NAME,
                     CONF_HUMAN_DETECTION_MSG, CONF_MOTION_START_MSG,
@@ -17,10 +19,18 @@ from .const import (ALLWINNER, ALLWINNERV2, CONF_ANIMAL_DETECTION_MSG,
                     CONF_SOUND_DETECTION_MSG, CONF_TOPIC_MOTION_DETECTION,
                     CONF_TOPIC_MOTION_DETECTION_IMAGE,
                     CONF_TOPIC_SOUND_DETECTION, CONF_TOPIC_STATUS,
-                    CONF_VEHICLE_DETECTION_MSG, CONF_WILL_MSG, DEFAULT_BRAND,
-                    DOMAIN, MSTAR, SONOFF, V5)
+                    CONF_SNAPSHOT_TTL, CONF_VEHICLE_DETECTION_MSG,
+                    CONF_WILL_MSG, DATA_API, DATA_MOTION_IMAGES,
+                    DATA_RECORDINGS, DATA_SETUP_TIMINGS,
+                    DATA_SNAPSHOT_CACHE, DATA_SNAPSHOT_STATS, DEFAULT_BRAND,
+                    DEFAULT_SNAPSHOT_TTL, DOMAIN, HTTP_TIMEOUT,
+                    MOTION_IMAGES_MAX_BYTES, MOTION_IMAGES_MAX_COUNT, MSTAR,
+                    RECORDINGS_STORAGE_KEY, SONOFF, STORAGE_KEY,
+                    STORAGE_VERSION, V5)
+from .recordings import RecordingsIndex
 
-from .views import VideoProxyView
+from .services import async_setup_services, async_unload_services
+from .views import CameraImageView, MotionImageView, VideoProxyView
 
 PLATFORMS = ["camera", "binary_sensor", "media_player", "select", "switch"]
 PLATFORMS_SONOFF = ["camera", "binary_sensor", "select", "switch"]
@@ -35,79 +45,67 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     device_name=entry.data[CONF_NAME]
 
     hass.data.setdefault(DOMAIN, {})
-    hass.data[DOMAIN][device_name] = {}
+    api = YiHackApi(hass, entry.data)
+    timings = {}
+    hass.data[DOMAIN][device_name] = {
+        DATA_API: api,
+        DATA_SETUP_TIMINGS: timings,
+        DATA_SNAPSHOT_CACHE: SnapshotCache(hass, entry.options.get(CONF_SNAPSHOT_TTL, DEFAULT_SNAPSHOT_TTL)),
+        DATA_SNAPSHOT_STATS: {"http": LatencyStats(), "ffmpeg": LatencyStats()},
+        DATA_MOTION_IMAGES: MotionImageBuffer(MOTION_IMAGES_MAX_COUNT, MOTION_IMAGES_MAX_BYTES),
+        DATA_RECORDINGS: RecordingsIndex(hass, api, entry.entry_id, device_name),
+    }
+    setup_start = time.monotonic()
 
-    stat = await hass.async_add_executor_job(get_status, entry.data)
+    store = Store(hass, STORAGE_VERSION, STORAGE_KEY + "." + entry.entry_id)
+    cached = await store.async_load()
 
-    if stat is not None:
-        try:
-            privacy = stat["privacy"]
-            _LOGGER.error("Unsupported hack version (" + entry.data[CONF_HOST] + "), please update your cam")
+    if cached is None:
+        stat, system_conf, mqtt_conf = await _async_probe(api, timings)
+        if not _check_status(entry, stat):
             return False
-        except KeyError:
-            privacy = None
-
-    system_conf = await hass.async_add_executor_job(get_system_conf, entry.data)
-    mqtt_conf = await hass.async_add_executor_job(get_mqtt_conf, entry.data)
+        if system_conf is not None and mqtt_conf is not None:
+            await store.async_save({"system": system_conf, "mqtt": mqtt_conf})
+    else:
+        # Start from the last good configuration, then check it in background
+        system_conf = cached["system"]
+        mqtt_conf = cached["mqtt"]
+        timings["cache"] = _elapsed(setup_start)
 
     if system_conf is not None and mqtt_conf is not None:
-        updated_data = {
-            **entry.data,
-            CONF_MQTT_PREFIX: mqtt_conf[CONF_MQTT_PREFIX],
-            CONF_TOPIC_STATUS: mqtt_conf[CONF_TOPIC_STATUS],
-            CONF_TOPIC_MOTION_DETECTION: mqtt_conf[CONF_TOPIC_MOTION_DETECTION],
-            CONF_MOTION_START_MSG: mqtt_conf[CONF_MOTION_START_MSG],
-            CONF_MOTION_STOP_MSG: mqtt_conf[CONF_MOTION_STOP_MSG],
-            CONF_BIRTH_MSG: mqtt_conf[CONF_BIRTH_MSG],
-            CONF_WILL_MSG: mqtt_conf[CONF_WILL_MSG],
-            CONF_TOPIC_MOTION_DETECTION_IMAGE: mqtt_conf[CONF_TOPIC_MOTION_DETECTION_IMAGE],
-        }
-        if (entry.data[CONF_HACK_NAME] == DEFAULT_BRAND) or (entry.data[CONF_HACK_NAME] == MSTAR):
-            updated_data.update(**{
-                CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
-                CONF_BABY_CRYING_MSG: mqtt_conf[CONF_BABY_CRYING_MSG],
-            })
-        elif (entry.data[CONF_HACK_NAME] == V5):
-            updated_data.update(**{
-                CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
-                CONF_TOPIC_SOUND_DETECTION: mqtt_conf[CONF_TOPIC_SOUND_DETECTION],
-                CONF_BABY_CRYING_MSG: mqtt_conf[CONF_BABY_CRYING_MSG],
-                CONF_SOUND_DETECTION_MSG: mqtt_conf[CONF_SOUND_DETECTION_MSG],
-            })
-        elif (entry.data[CONF_HACK_NAME] == ALLWINNER):
-            updated_data.update(**{
-                CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
-                CONF_TOPIC_SOUND_DETECTION: mqtt_conf[CONF_TOPIC_SOUND_DETECTION],
-                CONF_HUMAN_DETECTION_MSG: mqtt_conf[CONF_HUMAN_DETECTION_MSG],
-                CONF_VEHICLE_DETECTION_MSG: mqtt_conf[CONF_VEHICLE_DETECTION_MSG],
-                CONF_ANIMAL_DETECTION_MSG: mqtt_conf[CONF_ANIMAL_DETECTION_MSG],
-                CONF_SOUND_DETECTION_MSG: mqtt_conf[CONF_SOUND_DETECTION_MSG],
-            })
-        elif (entry.data[CONF_HACK_NAME] == ALLWINNERV2):
-            updated_data.update(**{
-                CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
-                CONF_TOPIC_SOUND_DETECTION: mqtt_conf[CONF_TOPIC_SOUND_DETECTION],
-                CONF_HUMAN_DETECTION_MSG: mqtt_conf[CONF_HUMAN_DETECTION_MSG],
-                CONF_VEHICLE_DETECTION_MSG: mqtt_conf[CONF_VEHICLE_DETECTION_MSG],
-                CONF_ANIMAL_DETECTION_MSG: mqtt_conf[CONF_ANIMAL_DETECTION_MSG],
-                CONF_SOUND_DETECTION_MSG: mqtt_conf[CONF_SOUND_DETECTION_MSG],
-            })
-        elif entry.data[CONF_HACK_NAME] == SONOFF:
-            updated_data.update(**{
-                CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
-            })
-
+        updated_data = _get_updated_data(entry.data, system_conf, mqtt_conf)
         hass.config_entries.async_update_entry(entry, data=updated_data)
 
+        # Reload when the options or the cam configuration change
+        entry.async_on_unload(entry.add_update_listener(_async_update_listener))
+        if cached is not None:
+            entry.async_create_background_task(
+                hass,
+                _async_revalidate(entry, api, store),
+                "yi_hack revalidate " + device_name,
+            )
+
+        platforms_start = time.monotonic()
         if (entry.data[CONF_HACK_NAME] == V5):
             await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS_V5)
         elif (entry.data[CONF_HACK_NAME] == SONOFF):
             await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS_SONOFF)
         else:
             await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+        timings["platforms"] = _elapsed(platforms_start)
 
-        session = async_get_clientsession(hass)
-        hass.http.register_view(VideoProxyView(hass, session))
+        views_start = time.monotonic()
+        hass.http.register_view(VideoProxyView(hass))
+        hass.http.register_view(MotionImageView(hass))
+        hass.http.register_view(CameraImageView(hass))
+        timings["views"] = _elapsed(views_start)
+
+        async_setup_services(hass)
+
+        await _async_subscribe_motion(hass, entry)
+
+        timings["total"] = _elapsed(setup_start)
+        _LOGGER.debug("Setup of %s completed in %ss: %s", device_name, timings["total"], timings)
 
         async def init_status():
             await asyncio.sleep(10)
@@ -121,6 +119,149 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         return False
 
 
+async def _async_subscribe_motion(hass, entry):
+    """Update the recordings index when the cam saved a motion recording."""
+    recordings = hass.data[DOMAIN][entry.data[CONF_NAME]][DATA_RECORDINGS]
+
+    @callback
+    def motion_message_received(msg):
+        """Fetch the recordings of the current hour when a motion stops."""
+        try:
+            payload = msg.payload.decode("utf-8", "ignore")
+        except:
+            payload = msg.payload
+
+        if payload == entry.data[CONF_MOTION_STOP_MSG]:
+            recordings.async_motion_stopped()
+
+    entry.async_on_unload(
+        await mqtt.async_subscribe(
+            hass,
+            entry.data[CONF_MQTT_PREFIX] + "/" + entry.data[CONF_TOPIC_MOTION_DETECTION],
+            motion_message_received,
+            1,
+            None,
+        )
+    )
+
+
+async def _async_probe(api, timings):
+    """Get status and configurations from the cam."""
+    start = time.monotonic()
+
+    # Probe the cam concurrently: an unreachable cam costs a single timeout
+    try:
+        async with asyncio.timeout(HTTP_TIMEOUT):
+            result = await asyncio.gather(
+                _async_timed(timings, "status", api.async_get_status()),
+                _async_timed(timings, "system_conf", api.async_get_system_conf()),
+                _async_timed(timings, "mqtt_conf", api.async_get_mqtt_conf()),
+            )
+    except TimeoutError:
+        _LOGGER.error("Timeout getting status and configuration from device %s", api.host)
+        result = (None, None, None)
+
+    timings["probes"] = _elapsed(start)
+    return result
+
+
+def _check_status(entry, stat):
+    """Return False if the hack version of the cam is not supported."""
+    if stat is not None and "privacy" in stat:
+        _LOGGER.error("Unsupported hack version (" + entry.data[CONF_HOST] + "), please update your cam")
+        return False
+
+    return True
+
+
+def _get_updated_data(data, system_conf, mqtt_conf):
+    """Merge the cam configuration into the config entry data."""
+    updated_data = {
+        **data,
+        CONF_MQTT_PREFIX: mqtt_conf[CONF_MQTT_PREFIX],
+        CONF_TOPIC_STATUS: mqtt_conf[CONF_TOPIC_STATUS],
+        CONF_TOPIC_MOTION_DETECTION: mqtt_conf[CONF_TOPIC_MOTION_DETECTION],
+        CONF_MOTION_START_MSG: mqtt_conf[CONF_MOTION_START_MSG],
+        CONF_MOTION_STOP_MSG: mqtt_conf[CONF_MOTION_STOP_MSG],
+        CONF_BIRTH_MSG: mqtt_conf[CONF_BIRTH_MSG],
+        CONF_WILL_MSG: mqtt_conf[CONF_WILL_MSG],
+        CONF_TOPIC_MOTION_DETECTION_IMAGE: mqtt_conf[CONF_TOPIC_MOTION_DETECTION_IMAGE],
+    }
+    if (data[CONF_HACK_NAME] == DEFAULT_BRAND) or (data[CONF_HACK_NAME] == MSTAR):
+        updated_data.update(**{
+            CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
+            CONF_BABY_CRYING_MSG: mqtt_conf[CONF_BABY_CRYING_MSG],
+        })
+    elif (data[CONF_HACK_NAME] == V5):
+        updated_data.update(**{
+            CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
+            CONF_TOPIC_SOUND_DETECTION: mqtt_conf[CONF_TOPIC_SOUND_DETECTION],
+            CONF_BABY_CRYING_MSG: mqtt_conf[CONF_BABY_CRYING_MSG],
+            CONF_SOUND_DETECTION_MSG: mqtt_conf[CONF_SOUND_DETECTION_MSG],
+        })
+    elif (data[CONF_HACK_NAME] == ALLWINNER):
+        updated_data.update(**{
+            CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
+            CONF_TOPIC_SOUND_DETECTION: mqtt_conf[CONF_TOPIC_SOUND_DETECTION],
+            CONF_HUMAN_DETECTION_MSG: mqtt_conf[CONF_HUMAN_DETECTION_MSG],
+            CONF_VEHICLE_DETECTION_MSG: mqtt_conf[CONF_VEHICLE_DETECTION_MSG],
+            CONF_ANIMAL_DETECTION_MSG: mqtt_conf[CONF_ANIMAL_DETECTION_MSG],
+            CONF_SOUND_DETECTION_MSG: mqtt_conf[CONF_SOUND_DETECTION_MSG],
+        })
+    elif (data[CONF_HACK_NAME] == ALLWINNERV2):
+        updated_data.update(**{
+            CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
+            CONF_TOPIC_SOUND_DETECTION: mqtt_conf[CONF_TOPIC_SOUND_DETECTION],
+            CONF_HUMAN_DETECTION_MSG: mqtt_conf[CONF_HUMAN_DETECTION_MSG],
+            CONF_VEHICLE_DETECTION_MSG: mqtt_conf[CONF_VEHICLE_DETECTION_MSG],
+            CONF_ANIMAL_DETECTION_MSG: mqtt_conf[CONF_ANIMAL_DETECTION_MSG],
+            CONF_SOUND_DETECTION_MSG: mqtt_conf[CONF_SOUND_DETECTION_MSG],
+        })
+    elif data[CONF_HACK_NAME] == SONOFF:
+        updated_data.update(**{
+            CONF_RTSP_PORT: system_conf[CONF_RTSP_PORT],
+        })
+
+    return updated_data
+
+
+async def _async_revalidate(entry, api, store):
+    """Refresh the cached configuration and reload the entry if it changed."""
+    timings = {}
+    stat, system_conf, mqtt_conf = await _async_probe(api, timings)
+    if not _check_status(entry, stat):
+        return
+    if system_conf is None or mqtt_conf is None:
+        _LOGGER.warning("Unable to get configuration from the cam %s, using the cached one", api.host)
+        return
+
+    await store.async_save({"system": system_conf, "mqtt": mqtt_conf})
+
+    updated_data = _get_updated_data(entry.data, system_conf, mqtt_conf)
+    if updated_data != entry.data:
+        _LOGGER.info("Configuration of %s changed, reloading", entry.data[CONF_NAME])
+        api.hass.config_entries.async_update_entry(entry, data=updated_data)
+
+
+async def _async_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the config entry."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
+def _elapsed(start):
+    """Return the seconds elapsed from start."""
+    return round(time.monotonic() - start, 3)
+
+
+async def _async_timed(timings, phase, coro):
+    """Await coro and record its duration in timings."""
+    start = time.monotonic()
+    try:
+        return await coro
+    finally:
+        timings[phase] = _elapsed(start)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Unload a config entry."""
     if (entry.data[CONF_HACK_NAME] == V5):
@@ -132,6 +273,14 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
 
     if unload_ok:
         device_name=entry.data[CONF_NAME]
-        hass.data[DOMAIN].pop(device_name)
+        hass.data[DOMAIN].pop(device_name)[DATA_RECORDINGS].close()
+        if not hass.data[DOMAIN]:
+            async_unload_services(hass)
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the cached configuration and recordings of a config entry."""
+    await Store(hass, STORAGE_VERSION, STORAGE_KEY + "." + entry.entry_id).async_remove()
+    await Store(hass, STORAGE_VERSION, RECORDINGS_STORAGE_KEY + "." + entry.entry_id).async_remove()
@@ -0,0 +1,263 @@
+"""Cache of the audio transcoded for the yi-hack cam speakers."""
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Any
+
+import aiohttp
+from aiohttp import hdrs
+from yarl import URL
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .const import (DATA_PCM_CACHE, HTTP_TIMEOUT, PCM_CACHE_CHUNK_SIZE,
+                    PCM_CACHE_MAX_BYTES, PCM_CACHE_MAX_SOURCE_BYTES)
+
+_LOGGER = logging.getLogger(__name__)
+
+PCM_SUFFIX = ".pcm"
+
+
+class PcmCache:
+    """Keep the transcoded audio of the latest played media on disk.
+
+    Entries are keyed by the media url and its ETag, Last-Modified or
+    content hash. The validators are read with a HEAD request; a media
+    without them is downloaded once to a local file, hashed on the way, and
+    the file is given to FFmpeg. The least recently played entries are
+    removed when the cache is bigger than its size cap.
+    """
+
+    def __init__(self, hass: HomeAssistant, path: str, max_bytes: int) -> None:
+        """Initialize the cache."""
+        self.hass = hass
+        self._path = path
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def async_load(self) -> None:
+        """Read the entries already on disk, the least recently used first."""
+        async with self._lock:
+            if self._loaded:
+                return
+            entries = await self.hass.async_add_executor_job(self._scan)
+            for key, size in entries:
+                self._entries[key] = size
+                self._size += size
+            self._loaded = True
+
+    def _scan(self) -> list[tuple[str, int]]:
+        """List the entries on disk."""
+        os.makedirs(self._path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self._path):
+            if entry.name.endswith(PCM_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(PCM_SUFFIX)], stat.st_size))
+            else:
+                # Leftover of an interrupted transcoding
+                os.remove(entry.path)
+        return [(key, size) for _, key, size in sorted(entries)]
+
+    def _file(self, key: str) -> str:
+        """Return the file of an entry."""
+        return os.path.join(self._path, key + PCM_SUFFIX)
+
+    async def async_get_key(self, url: str) -> str | None:
+        """Return the key of a media from its validators, None if it has none."""
+        url = URL(url)
+        if url.scheme not in ("http", "https"):
+            return None
+
+        session = async_get_clientsession(self.hass)
+        try:
+            async with session.head(url, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)) as response:
+                if response.status >= 300:
+                    return None
+                validator = response.headers.get(hdrs.ETAG) or response.headers.get(hdrs.LAST_MODIFIED)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            _LOGGER.debug("Unable to check %s for the audio cache: %s", url, error)
+            return None
+
+        if validator is None:
+            return None
+        return _get_key(url, validator)
+
+    async def async_download(self, url: str) -> tuple[str, str] | None:
+        """Download a media without validators, return its key from the content hash and its local file.
+
+        The file is seekable, unlike a pipe, and must be removed with
+        async_remove_download. Return None if the media can't be downloaded
+        or is too big, FFmpeg then reads it from its url.
+        """
+        url = URL(url)
+        if url.scheme not in ("http", "https"):
+            return None
+
+        await self.async_load()
+        try:
+            file = await self.hass.async_add_executor_job(self._create_download)
+        except OSError as error:
+            _LOGGER.warning("Unable to write the audio cache: %s", error)
+            return None
+
+        session = async_get_clientsession(self.hass)
+        # No total timeout, a big media may take longer than HTTP_TIMEOUT
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_TIMEOUT, sock_read=HTTP_TIMEOUT)
+        digest = hashlib.blake2b()
+        size = 0
+        complete = False
+        try:
+            async with session.get(url, timeout=timeout) as response:
+                if response.status >= 300:
+                    return None
+                async for chunk in response.content.iter_chunked(PCM_CACHE_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > PCM_CACHE_MAX_SOURCE_BYTES:
+                        return None
+                    digest.update(chunk)
+                    await self.hass.async_add_executor_job(file.write, chunk)
+            complete = True
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+            _LOGGER.debug("Unable to download %s for the audio cache: %s", url, error)
+            return None
+        finally:
+            await self.hass.async_add_executor_job(file.close)
+            if not complete:
+                await self.async_remove_download(file.name)
+
+        return _get_key(url, digest.hexdigest()), file.name
+
+    def _create_download(self):
+        """Create the file of a download, removed at the next load if left behind."""
+        return tempfile.NamedTemporaryFile(suffix=".tmp", dir=self._path, delete=False)
+
+    async def async_remove_download(self, path: str) -> None:
+        """Remove the file of a download."""
+        await self.hass.async_add_executor_job(_remove, path)
+
+    async def async_read(self, key: str) -> AsyncIterator[bytes] | None:
+        """Return the audio of an entry, None if it is not cached."""
+        await self.async_load()
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        try:
+            file = await self.hass.async_add_executor_job(self._open, key)
+        except OSError as error:
+            _LOGGER.warning("Unable to read the cached audio %s: %s", key, error)
+            self._discard(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._iter_file(file)
+
+    def _open(self, key: str):
+        """Open an entry and mark it as recently used."""
+        path = self._file(key)
+        os.utime(path)
+        return open(path, "rb")
+
+    async def _iter_file(self, file) -> AsyncIterator[bytes]:
+        """Yield the content of a file."""
+        try:
+            while chunk := await self.hass.async_add_executor_job(file.read, PCM_CACHE_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await self.hass.async_add_executor_job(file.close)
+
+    async def async_write(self, key: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Yield the chunks, storing them as a new entry when they are complete."""
+        await self.async_load()
+        temp_path = self._file(key) + "." + str(id(chunks)) + ".tmp"
+        try:
+            file = await self.hass.async_add_executor_job(open, temp_path, "wb")
+        except OSError as error:
+            _LOGGER.warning("Unable to write the audio cache: %s", error)
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        size = 0
+        complete = False
+        try:
+            async for chunk in chunks:
+                await self.hass.async_add_executor_job(file.write, chunk)
+                size += len(chunk)
+                yield chunk
+            complete = True
+        finally:
+            await self.hass.async_add_executor_job(file.close)
+            if complete:
+                await self.hass.async_add_executor_job(os.replace, temp_path, self._file(key))
+                self._add(key, size)
+            else:
+                await self.hass.async_add_executor_job(_remove, temp_path)
+
+    def discard(self, key: str) -> None:
+        """Remove an entry, e.g. when its transcoding failed."""
+        if key in self._entries:
+            self._discard(key)
+
+    def _add(self, key: str, size: int) -> None:
+        """Add an entry and remove the least recently used ones above the size cap."""
+        if key in self._entries:
+            self._size -= self._entries.pop(key)
+        self._entries[key] = size
+        self._size += size
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: str) -> None:
+        """Remove an entry and its file."""
+        self._size -= self._entries.pop(key)
+        self.hass.async_add_executor_job(_remove, self._file(key))
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the cache metrics."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _get_key(url: URL, validator: str) -> str:
+    """Return the key of a media version."""
+    # The signature of media source urls changes at every play
+    url = url.with_query({k: v for k, v in url.query.items() if k != "authSig"})
+    return hashlib.sha256((str(url) + "\n" + validator).encode()).hexdigest()
+
+
+def _remove(path: str) -> None:
+    """Remove a file if it exists."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_pcm_cache(hass: HomeAssistant) -> PcmCache:
+    """Return the audio cache shared by all the cams."""
+    if DATA_PCM_CACHE not in hass.data:
+        hass.data[DATA_PCM_CACHE] = PcmCache(
+            hass, hass.config.path(".cache", "yi_hack", "pcm"), PCM_CACHE_MAX_BYTES
+        )
+    return hass.data[DATA_PCM_CACHE]
@@ -13,6 +13,7 @@ from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers import event
 from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 
+from .common import get_api
 from .const import (ALLWINNER, ALLWINNERV2, CONF_ANIMAL_DETECTION_MSG,
                     CONF_BABY_CRYING_MSG, CONF_BIRTH_MSG, CONF_HACK_NAME,
                     CONF_HUMAN_DETECTION_MSG, CONF_MOTION_START_MSG,
@@ -77,6 +78,7 @@ class YiMQTTBinarySensor(BinarySensorEntity):
         self._name = self._device_name + " " + name
         self._mac = config.data[CONF_MAC]
         self._mqtt_subscription = None
+        self._api = None
         self._delay_listener = None
         self._payload_off = None
         self._off_delay = None
@@ -158,10 +160,16 @@ class YiMQTTBinarySensor(BinarySensorEntity):
 
             if payload == self._payload_on:
                 self._state = True
+                # Resume http requests when the cam connects
+                if self._api is not None:
+                    self._api.breaker.record_success()
             elif payload == self._payload_off:
                 self._state = False
-                # Reset motion_detection sensor when the cam disconnects
                 if self._unique_id == self._device_name + "_bsst":
+                    # Stop http requests until the cam connects again
+                    if self._api is not None:
+                        self._api.breaker.trip()
+                    # Reset motion_detection sensor when the cam disconnects
                     self.hass.async_create_task(
                         mqtt.async_publish(
                             self.hass,
@@ -192,6 +200,9 @@ class YiMQTTBinarySensor(BinarySensorEntity):
 
             self.async_write_ha_state()
 
+        if self._unique_id == self._device_name + "_bsst":
+            self._api = get_api(self.hass, self._device_name)
+
         self._mqtt_subscription = await mqtt.async_subscribe(
             self.hass, self._state_topic, message_received, 1
         )
@@ -1,31 +1,50 @@
 from __future__ import annotations
 
 import asyncio
+import datetime as dt
+import errno
+import functools
 import logging
-
-import requests
-from requests.auth import HTTPBasicAuth
+import time
 
 import voluptuous as vol
-from haffmpeg.camera import CameraMjpeg
 from haffmpeg.tools import IMAGE_JPEG, ImageFrame
+import aiohttp
+from aiohttp import hdrs, web
 from homeassistant.components import mqtt
-from homeassistant.components.camera import (Camera, CameraEntityFeature)
+from homeassistant.components.camera import (Camera, CameraEntityFeature,
+                                             Image)
+from homeassistant.components.camera.img_util import scale_jpeg_camera_image
 from homeassistant.components.ffmpeg import CONF_EXTRA_ARGUMENTS, DATA_FFMPEG
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (CONF_HOST, CONF_MAC, CONF_NAME, CONF_PASSWORD,
                                  CONF_PORT, CONF_USERNAME, STATE_OFF, STATE_ON)
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers import entity_platform
-from homeassistant.helpers.aiohttp_client import async_aiohttp_proxy_stream
 from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 
-from .const import (ALLWINNER, ALLWINNERV2, CONF_BOOST_SPEAKER, CONF_HACK_NAME,
-                    CONF_MQTT_PREFIX, CONF_PTZ,
-                    CONF_TOPIC_MOTION_DETECTION_IMAGE, DEFAULT_BRAND, DOMAIN,
-                    HTTP_TIMEOUT, LINK_HIGH_RES_STREAM, LINK_LOW_RES_STREAM,
-                    MSTAR, SERVICE_MOVE_TO_PRESET, SERVICE_PTZ,
-                    SERVICE_REBOOT, SERVICE_SPEAK)
+from .common import (ETagCache, YiHackUnavailableError, get_api,
+                     get_motion_images, get_snapshot_cache,
+                     get_snapshot_stats)
+from .const import (ALLWINNER, ALLWINNERV2, CONF_BIRTH_MSG, CONF_BOOST_SPEAKER,
+                    CONF_FRAME_GRABBER, CONF_HACK_NAME, CONF_MOTION_START_MSG,
+                    CONF_MQTT_PREFIX, CONF_PTZ, CONF_SNAPSHOT_HEDGE,
+                    CONF_SNAPSHOT_HEDGE_DELAY, CONF_SNAPSHOT_REFRESH_ON_MOTION,
+                    CONF_TOPIC_MOTION_DETECTION,
+                    CONF_TOPIC_MOTION_DETECTION_IMAGE, CONF_TOPIC_STATUS,
+                    DATA_FRAME_GRABBER, DATA_MJPEG_HUB, DATA_PTZ_QUEUE,
+                    DEFAULT_BRAND,
+                    DEFAULT_FRAME_GRABBER, DEFAULT_SNAPSHOT_HEDGE,
+                    DEFAULT_SNAPSHOT_HEDGE_DELAY,
+                    DEFAULT_SNAPSHOT_REFRESH_ON_MOTION, DOMAIN,
+                    GRABBER_MAX_AGE, LINK_HIGH_RES_STREAM, LINK_LOW_RES_STREAM,
+                    LOW_RES_HEIGHT, LOW_RES_WIDTH, MIN_SNAPSHOT_HEDGE_DELAY,
+                    MSTAR, PRIORITY_INTERACTIVE, RES_HIGH, RES_LOW,
+                    SERVICE_MOVE_TO_PRESET, SERVICE_PTZ, SERVICE_PTZ_START,
+                    SERVICE_PTZ_STOP, SERVICE_REBOOT, SERVICE_SPEAK)
+from .mjpeg import FrameGrabber, MjpegHub
+from .ptz import PtzQueue
+from .recordings import Recording, get_recordings
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -71,6 +90,27 @@ async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry, async_add_
         "async_perform_ptz",
     )
 
+    platform.async_register_entity_service(
+        SERVICE_PTZ_START,
+        {
+            vol.Required(ATTR_MOVEMENT): vol.In(
+                [
+                    DIR_UP,
+                    DIR_DOWN,
+                    DIR_LEFT,
+                    DIR_RIGHT,
+                ]
+            ),
+        },
+        "async_perform_ptz_start",
+    )
+
+    platform.async_register_entity_service(
+        SERVICE_PTZ_STOP,
+        {},
+        "async_perform_ptz_stop",
+    )
+
     platform.async_register_entity_service(
         SERVICE_MOVE_TO_PRESET,
         {
@@ -131,15 +171,48 @@ class YiHackCamera(Camera):
         self._password = config.data[CONF_PASSWORD]
         self._hack_name = config.data[CONF_HACK_NAME]
         self._ptz = config.data[CONF_PTZ]
+        self._api = get_api(hass, self._device_name)
+        self._snapshot_cache = get_snapshot_cache(hass, self._device_name)
+        self._snapshot_stats = get_snapshot_stats(hass, self._device_name)
+        self._etags = ETagCache()
+        self._ptz_queue = PtzQueue(hass, self._api, self._name)
+        hass.data[DOMAIN][self._device_name][DATA_PTZ_QUEUE] = self._ptz_queue
+        self._refresh_on_motion = config.options.get(CONF_SNAPSHOT_REFRESH_ON_MOTION, DEFAULT_SNAPSHOT_REFRESH_ON_MOTION)
+        self._hedge = config.options.get(CONF_SNAPSHOT_HEDGE, DEFAULT_SNAPSHOT_HEDGE)
+        self._hedge_delay = config.options.get(CONF_SNAPSHOT_HEDGE_DELAY, DEFAULT_SNAPSHOT_HEDGE_DELAY)
+        self._motion_topic = config.data[CONF_MQTT_PREFIX] + "/" + config.data[CONF_TOPIC_MOTION_DETECTION]
+        self._motion_start_msg = config.data[CONF_MOTION_START_MSG]
         self._mqtt_subscription = None
+        self._mqtt_motion_subscription = None
+        self._mqtt_status_subscription = None
         self._mqtt_cmnd_topic = config.data[CONF_MQTT_PREFIX] + "/cmnd/camera/switch_on"
         self._mqtt_stat_topic = config.data[CONF_MQTT_PREFIX] + "/stat/camera/switch_on"
+        self._status_topic = config.data[CONF_MQTT_PREFIX] + "/" + config.data[CONF_TOPIC_STATUS]
+        self._birth_msg = config.data[CONF_BIRTH_MSG]
+        self._online = asyncio.Event()
+        self._stream_sources = None
+        self._mjpeg_hub = MjpegHub(
+            hass,
+            self._name,
+            self._manager.binary,
+            self._extra_arguments,
+            self.stream_source,
+            self._invalidate_stream_source,
+        )
+        hass.data[DOMAIN][self._device_name][DATA_MJPEG_HUB] = self._mjpeg_hub
+        self._frame_grabber = None
+        if config.options.get(CONF_FRAME_GRABBER, DEFAULT_FRAME_GRABBER):
+            self._frame_grabber = FrameGrabber(hass, self._mjpeg_hub)
+            hass.data[DOMAIN][self._device_name][DATA_FRAME_GRABBER] = self._frame_grabber
         self._state = True
 
         self._http_base_url = "http://" + self._host
         if self._port != 80:
             self._http_base_url += ":" + str(self._port)
-        self._still_image_url = self._http_base_url + "/cgi-bin/snapshot.sh?res=high&watermark=yes"
+        self._still_image_urls = {
+            RES_HIGH: "cgi-bin/snapshot.sh?res=high&watermark=yes",
+            RES_LOW: "cgi-bin/snapshot.sh?res=low&watermark=yes",
+        }
 
         try:
             self._boost_speaker = config.data[CONF_BOOST_SPEAKER]
@@ -176,10 +249,53 @@ class YiHackCamera(Camera):
             self.hass, self._mqtt_stat_topic, message_received, 1, None
         )
 
+        @callback
+        def motion_message_received(msg):
+            """Drop the cached snapshot when a motion starts."""
+            try:
+                payload = msg.payload.decode("utf-8", "ignore")
+            except:
+                payload = msg.payload
+
+            if payload == self._motion_start_msg:
+                self._snapshot_cache.invalidate()
+
+        if self._refresh_on_motion:
+            self._mqtt_motion_subscription = await mqtt.async_subscribe(
+                self.hass, self._motion_topic, motion_message_received, 1, None
+            )
+
+        @callback
+        def status_message_received(msg):
+            """Resolve the stream source again when the cam comes back online."""
+            try:
+                payload = msg.payload.decode("utf-8", "ignore")
+            except:
+                payload = msg.payload
+
+            if payload == self._birth_msg:
+                self._invalidate_stream_source()
+                self._online.set()
+
+        self._mqtt_status_subscription = await mqtt.async_subscribe(
+            self.hass, self._status_topic, status_message_received, 1, None
+        )
+
+        if self._frame_grabber:
+            self._frame_grabber.start()
+
     async def async_will_remove_from_hass(self):
         """Unsubscribe from MQTT events."""
         if self._mqtt_subscription:
             self._mqtt_subscription()
+        if self._mqtt_motion_subscription:
+            self._mqtt_motion_subscription()
+        if self._mqtt_status_subscription:
+            self._mqtt_status_subscription()
+        if self._frame_grabber:
+            self._frame_grabber.stop()
+        self._mjpeg_hub.stop()
+        self._ptz_queue.close()
 
     @property
     def supported_features(self) -> CameraEntityFeature:
@@ -202,122 +318,213 @@ class YiHackCamera(Camera):
 
     async def stream_source(self) -> str:
         """Return the stream source."""
-        def fetch_link():
-            """Get URL from camera available links."""
-            auth = None
-            if self._user or self._password:
-                auth = HTTPBasicAuth(self._user, self._password)
+        return await self._async_get_stream_source(RES_HIGH)
 
-            try:
-                response = requests.get(self._http_base_url + "/cgi-bin/links.sh",
-                                        timeout=HTTP_TIMEOUT, auth=auth)
-                if response.status_code < 300:
-                    links: dict = response.json()
-                    stream_source: str = links.get(LINK_HIGH_RES_STREAM) or links.get(LINK_LOW_RES_STREAM)
-                    if self._user or self._password:
-                        stream_source = stream_source.replace(
-                            "rtsp://", f"rtsp://{self._user}:{self._password}@", 1
-                        )
-
-                    return stream_source
-
-            except requests.exceptions.RequestException as error:
-                _LOGGER.error(
-                    "Error getting stream link from %s: %s",
-                    self._name,
-                    error,
-                )
+    async def _async_get_stream_source(self, res: str) -> str | None:
+        """Return the stream source of a resolution, or the other one if missing."""
+        if self._stream_sources is None:
+            self._stream_sources = await self._async_get_stream_sources()
+            if self._stream_sources is None:
+                return None
+
+        other = RES_LOW if res == RES_HIGH else RES_HIGH
+        return self._stream_sources.get(res) or self._stream_sources.get(other)
+
+    def _invalidate_stream_source(self) -> None:
+        """Resolve the stream source again the next time it is needed."""
+        self._stream_sources = None
 
+    async def _async_get_stream_sources(self) -> dict[str, str] | None:
+        """Get the stream sources from the camera."""
+        links = await self._api.async_get_json("cgi-bin/links.sh", shared=True)
+        if links is None:
+            _LOGGER.error("Error getting stream link from %s", self._name)
             return None
 
-        return await self.hass.async_add_executor_job(fetch_link)
+        stream_sources = {}
+        for res, link in ((RES_HIGH, LINK_HIGH_RES_STREAM), (RES_LOW, LINK_LOW_RES_STREAM)):
+            stream_source: str = links.get(link)
+            if stream_source and (self._user or self._password):
+                stream_source = stream_source.replace(
+                    "rtsp://", f"rtsp://{self._user}:{self._password}@", 1
+                )
+            stream_sources[res] = stream_source
+
+        return stream_sources
 
     async def async_camera_image(
-        self, width: int | None = None, height: int | None = None
+        self, width: int | None = None, height: int | None = None, max_age: float | None = None
     ) -> bytes | None:
         """Return a still image response from the camera."""
-        """Ignore width and height when the image is fetched from url."""
-        """Camera component will resize it."""
-        image = None
-
-        if self._still_image_url:
-            auth = None
-            if self._user or self._password:
-                auth = HTTPBasicAuth(self._user, self._password)
-
-            def fetch():
-                """Read image from a URL."""
-                try:
-                    response = requests.get(self._still_image_url, timeout=HTTP_TIMEOUT, auth=auth)
-                    if response.status_code < 300:
-                        return response.content
-                except requests.exceptions.RequestException as error:
-                    _LOGGER.error(
-                        "Fetch snapshot image failed from %s, falling back to FFmpeg; %s",
-                        self._name,
-                        error,
-                    )
+        """Use the low resolution snapshot for small sizes."""
+        """Resized images are cached with the snapshot."""
+        """max_age overrides the snapshot TTL for this call."""
+        if self._frame_grabber and self._frame_grabber.image is not None:
+            grabber_max_age = GRABBER_MAX_AGE if max_age is None else min(max_age, GRABBER_MAX_AGE)
+            if self._frame_grabber.age < grabber_max_age:
+                return self._frame_grabber.image
+
+        res = RES_HIGH
+        if width is not None or height is not None:
+            if (width or 0) <= LOW_RES_WIDTH and (height or 0) <= LOW_RES_HEIGHT:
+                res = RES_LOW
+
+        image = await self._snapshot_cache.async_get(
+            functools.partial(self._async_fetch_image, res), max_age=max_age, key=res
+        )
+        if image is None or width is None or height is None:
+            return image
 
-                return None
+        return await self._snapshot_cache.async_get(
+            functools.partial(self._async_resize_image, image, width, height),
+            max_age=max_age,
+            key=(res, width, height),
+        )
+
+    async def async_camera_image_etag(
+        self, width: int | None = None, height: int | None = None, max_age: float | None = None
+    ) -> tuple[bytes, str] | None:
+        """Return a still image and its ETag."""
+        image = await self.async_camera_image(width, height, max_age)
+        if image is None:
+            return None
+        return image, self._etags.get(image)
 
-            image = await self.hass.async_add_executor_job(fetch)
-            if image is None:
-                await asyncio.sleep(1)
-                image = await self.hass.async_add_executor_job(fetch)
-            if image is None:
-                await asyncio.sleep(1)
-                image = await self.hass.async_add_executor_job(fetch)
+    async def _async_resize_image(self, image: bytes, width: int, height: int) -> bytes:
+        """Scale down an image to the requested size."""
+        return await self.hass.async_add_executor_job(
+            scale_jpeg_camera_image, Image(self.content_type, image), width, height
+        )
+
+    async def _async_fetch_image(self, res: str) -> bytes | None:
+        """Get a new image from the camera."""
+        if self._hedge:
+            return await self._async_fetch_image_hedged(res)
+
+        image = await self._async_fetch_http_image(res)
+        if image is None and self._api.available:
+            await asyncio.sleep(1)
+            image = await self._async_fetch_http_image(res)
+        if image is None and self._api.available:
+            await asyncio.sleep(1)
+            image = await self._async_fetch_http_image(res)
 
         if image is None:
-            stream_source = await self.stream_source()
-            if stream_source:
-                ffmpeg = ImageFrame(self.hass.data[DATA_FFMPEG].binary)
-                image = await asyncio.shield(
-                    ffmpeg.get_image(
-                        stream_source,
-                        output_format=IMAGE_JPEG,
-                        extra_cmd=self._extra_arguments
-                    )
-                )
+            _LOGGER.debug("Fetch snapshot image failed from %s, falling back to FFmpeg", self._name)
+            image = await self._async_fetch_ffmpeg_image(res)
 
         return image
 
-    async def handle_async_mjpeg_stream(self, request):
-        """Generate an HTTP MJPEG stream from the camera."""
-        _LOGGER.debug("Handling mjpeg stream from camera '%s'", self._name)
+    async def _async_fetch_image_hedged(self, res: str) -> bytes | None:
+        """Race the http snapshot against an FFmpeg frame grab, started if http is late."""
+        paths = {}
+        pending = set()
+
+        if self._api.available:
+            # Not shared: the request must really stop when FFmpeg wins
+            http = asyncio.create_task(self._async_fetch_http_image(res, shared=False))
+            paths[http] = "http"
+            done, pending = await asyncio.wait({http}, timeout=self._get_hedge_delay())
+            if done and http.result() is not None:
+                self._snapshot_stats["http"].wins += 1
+                return http.result()
+            _LOGGER.debug("Snapshot from %s is late, starting FFmpeg", self._name)
+
+        ffmpeg = asyncio.create_task(self._async_fetch_ffmpeg_image(res))
+        paths[ffmpeg] = "ffmpeg"
+        pending.add(ffmpeg)
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    image = task.result()
+                    if image is not None:
+                        self._snapshot_stats[paths[task]].wins += 1
+                        return image
+        finally:
+            # The first image wins, drop the other request
+            for task in pending:
+                task.cancel()
+
+        return None
+
+    def _get_hedge_delay(self) -> float:
+        """Return how long to wait for the http snapshot, based on its recent latency."""
+        p90 = self._snapshot_stats["http"].percentile(0.9)
+        if p90 is None:
+            return self._hedge_delay
+        return min(self._hedge_delay, max(MIN_SNAPSHOT_HEDGE_DELAY, p90))
+
+    async def _async_fetch_http_image(self, res: str, shared: bool = True) -> bytes | None:
+        """Get the snapshot from the http server of the camera."""
+        start = time.monotonic()
+        try:
+            image = await self._api.async_request(
+                "GET", self._still_image_urls[res], priority=PRIORITY_INTERACTIVE, shared=shared
+            )
+        except asyncio.CancelledError:
+            # A late snapshot beaten by FFmpeg must still raise the hedge delay
+            self._snapshot_stats["http"].add_cancelled(time.monotonic() - start)
+            raise
+        self._snapshot_stats["http"].add(time.monotonic() - start, image is not None)
+        return image
 
-        stream_source = await self.stream_source()
+    async def _async_fetch_ffmpeg_image(self, res: str) -> bytes | None:
+        """Grab a frame from the stream of the camera with FFmpeg."""
+        stream_source = await self._async_get_stream_source(res)
         if not stream_source:
-            return super().handle_async_mjpeg_stream(request)
+            return None
 
-        stream = CameraMjpeg(self._manager.binary)
-        await stream.open_camera(
-            stream_source,
-            extra_cmd=self._extra_arguments
-        )
+        start = time.monotonic()
+        ffmpeg = ImageFrame(self.hass.data[DATA_FFMPEG].binary)
+        try:
+            image = await ffmpeg.get_image(
+                stream_source,
+                output_format=IMAGE_JPEG,
+                extra_cmd=self._extra_arguments
+            )
+        except asyncio.CancelledError:
+            if ffmpeg.is_running:
+                ffmpeg.kill()
+            self._snapshot_stats["ffmpeg"].add_cancelled(time.monotonic() - start)
+            raise
+
+        self._snapshot_stats["ffmpeg"].add(time.monotonic() - start, bool(image))
+        if not image:
+            self._invalidate_stream_source()
+        return image or None
 
+    async def handle_async_mjpeg_stream(self, request):
+        """Generate an HTTP MJPEG stream from the camera."""
+        _LOGGER.debug("Handling mjpeg stream from camera '%s'", self._name)
+
+        # All the viewers share the same FFmpeg process
+        queue = self._mjpeg_hub.subscribe()
         try:
-            stream_reader = await stream.get_reader()
-            return await async_aiohttp_proxy_stream(
-                self.hass,
-                request,
-                stream_reader,
-                self._manager.ffmpeg_stream_content_type,
+            frame = await queue.get()
+            if frame is None:
+                return await super().handle_async_mjpeg_stream(request)
+
+            response = web.StreamResponse(
+                headers={hdrs.CONTENT_TYPE: self._manager.ffmpeg_stream_content_type}
             )
+            await response.prepare(request)
+            while frame is not None:
+                await response.write(frame)
+                frame = await queue.get()
+        except ConnectionResetError:
+            pass
         finally:
-            await stream.close()
+            self._mjpeg_hub.unsubscribe(queue)
 
-    def _perform_ptz(self, movement, travel_time_str):
-        auth = None
-        if self._user or self._password:
-            auth = HTTPBasicAuth(self._user, self._password)
+        return response
 
-        try:
-            response = requests.get("http://" + self._host + ":" + str(self._port) + "/cgi-bin/ptz.sh?dir=" + movement + "&time=" + travel_time_str, timeout=HTTP_TIMEOUT, auth=auth)
-            if response.status_code >= 300:
-                _LOGGER.error("Failed to send ptz command to device %s", self._host)
-        except requests.exceptions.RequestException as error:
-            _LOGGER.error("Failed to send ptz command to device %s: error %s", self._host, error)
+    async def _perform_ptz(self, movement, travel_time):
+        # Moves are queued: a burst of moves in the same direction becomes a longer one
+        result = await self._ptz_queue.async_move(movement, travel_time)
+        if result is False:
+            _LOGGER.error("Failed to send ptz command to device %s", self._host)
 
     async def async_perform_ptz(self, movement, travel_time):
         """Perform a PTZ action on the camera."""
@@ -328,85 +535,132 @@ class YiHackCamera(Camera):
             return
 
         try:
-            travel_time_str = str(travel_time)
+            travel_time = float(travel_time)
         except ValueError:
-            travel_time_str = str(DEFAULT_TRAVELTIME)
+            travel_time = DEFAULT_TRAVELTIME
 
-        await self.hass.async_add_executor_job(self._perform_ptz, movement, travel_time_str)
+        await self._perform_ptz(movement, travel_time)
 
-    def _perform_move_to_preset(self, preset_id):
-        auth = None
-        if self._user or self._password:
-            auth = HTTPBasicAuth(self._user, self._password)
+    async def async_perform_ptz_start(self, movement):
+        """Start moving the camera until ptz_stop is called."""
+        _LOGGER.debug("PTZ start '%s' on %s", movement, self._name)
 
-        try:
-            response = requests.get(f"http://{self._host}:{self._port}/cgi-bin/preset.sh?action=go_preset&num={preset_id}", timeout=HTTP_TIMEOUT, auth=auth)
-            if response.status_code >= 300:
-                _LOGGER.error(f"Failed to send go to preset command to device {self._host}")
-        except requests.exceptions.RequestException as error:
-            _LOGGER.error(f"Failed to send go to preset command to device {self._host}: error {error}")
+        if self._ptz == "no":
+            _LOGGER.error("PTZ is not available on %s", self._name)
+            return
+
+        self._ptz_queue.start(movement)
+
+    async def async_perform_ptz_stop(self):
+        """Stop moving the camera."""
+        _LOGGER.debug("PTZ stop on %s", self._name)
+
+        self._ptz_queue.stop()
+
+    async def _perform_move_to_preset(self, preset_id):
+        result = await self._ptz_queue.async_move_to_preset(preset_id)
+        if result is False:
+            _LOGGER.error(f"Failed to send go to preset command to device {self._host}")
+        return result is True
 
     async def async_perform_move_to_preset(self, preset_id):
         """Aim the camera at the given preset."""
         _LOGGER.debug(f"Move to preset {preset_id} on {self._name}")
 
-        await self.hass.async_add_executor_job(self._perform_move_to_preset, preset_id)
-
-    def _perform_speak(self, language, sentence):
-        response = None
+        await self._perform_move_to_preset(preset_id)
 
-        auth = None
-        if self._user or self._password:
-            auth = HTTPBasicAuth(self._user, self._password)
-
-        try:
-            url_speak = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speak.sh?lang=" + language
-            if self._boost_speaker == "auto":
-                if self._hack_name == MSTAR:
-                    url_speak = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speak.sh?lang=" + language + "&vol=4";
-                elif self._hack_name == ALLWINNERV2:
-                    url_speak = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speak.sh?lang=" + language + "&vol=3";
-            elif self._boost_speaker != "disabled":
-                url_speak = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speak.sh?lang=" + language + "&vol=" + str(self._boost_speaker[-1]);
-
-            response = requests.post(url_speak, data=sentence, timeout=HTTP_TIMEOUT, auth=auth)
-            if response.status_code >= 300:
-                _LOGGER.error("Failed to send speak command to device %s", self._host)
-        except requests.exceptions.RequestException as error:
-            _LOGGER.error("Failed to send speak command to device %s: error %s", self._host, error)
+    async def _perform_speak(self, language, sentence):
+        url_speak = "cgi-bin/speak.sh?lang=" + language
+        if self._boost_speaker == "auto":
+            if self._hack_name == MSTAR:
+                url_speak = "cgi-bin/speak.sh?lang=" + language + "&vol=4"
+            elif self._hack_name == ALLWINNERV2:
+                url_speak = "cgi-bin/speak.sh?lang=" + language + "&vol=3"
+        elif self._boost_speaker != "disabled":
+            url_speak = "cgi-bin/speak.sh?lang=" + language + "&vol=" + str(self._boost_speaker[-1])
 
+        response = await self._api.async_get_json(url_speak, method="POST", data=sentence, priority=PRIORITY_INTERACTIVE)
         if response is not None:
             try:
-                if response.json()["error"] == "true":
-                    _LOGGER.error("Failed to send speak command to device %s: error %s", self._host, response.json()["description"])
+                if response["error"] == "true":
+                    _LOGGER.error("Failed to send speak command to device %s: error %s", self._host, response["description"])
+                    return False
             except KeyError:
                 _LOGGER.error("Failed to send speak command to device %s: error unknown", self._host)
+                return False
         else:
             _LOGGER.error("Failed to send speak command to device %s: error unknown", self._host)
+            return False
+
+        return True
 
     async def async_perform_speak(self, language, sentence):
         """Perform a SPEAK action on the camera."""
         _LOGGER.debug("SPEAK action on %s", self._name)
 
-        await self.hass.async_add_executor_job(self._perform_speak, language, sentence)
-
-    def _perform_reboot(self):
-        auth = None
-        if self._user or self._password:
-            auth = HTTPBasicAuth(self._user, self._password)
+        await self._perform_speak(language, sentence)
 
+    async def _perform_reboot(self):
+        # The next birth message tells that the cam is back online
+        self._online.clear()
         try:
-            response = requests.get(f"http://{self._host}:{self._port}/cgi-bin/reboot.sh", timeout=HTTP_TIMEOUT, auth=auth)
-            if response.status_code >= 300:
-                _LOGGER.error(f"Failed to send reboot command to device {self._host}")
-        except requests.exceptions.RequestException as error:
-            _LOGGER.error(f"Failed to send reboot command to device {self._host}: error {error}")
+            async with self._api.async_open("GET", "cgi-bin/reboot.sh", priority=PRIORITY_INTERACTIVE) as response:
+                if response.status >= 300:
+                    _LOGGER.error(f"Failed to send reboot command to device {self._host}: status {response.status}")
+                    return False
+                await response.read()
+        except YiHackUnavailableError as error:
+            _LOGGER.error(f"Failed to send reboot command to device {self._host}: {error}")
+            return False
+        except (aiohttp.ServerDisconnectedError, aiohttp.ClientPayloadError) as error:
+            # The cam often goes down before answering
+            _LOGGER.debug(f"Device {self._host} closed the connection while rebooting: {error}")
+        except aiohttp.ClientOSError as error:
+            if error.errno != errno.ECONNRESET:
+                _LOGGER.error(f"Failed to send reboot command to device {self._host}: {error}")
+                return False
+            _LOGGER.debug(f"Device {self._host} reset the connection while rebooting: {error}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            _LOGGER.error(f"Failed to send reboot command to device {self._host}: {error}")
+            return False
+        return True
 
     async def async_perform_reboot(self):
         """Reboot the camera."""
         _LOGGER.debug(f"Reboot the camera")
 
-        await self.hass.async_add_executor_job(self._perform_reboot)
+        await self._perform_reboot()
+
+    async def async_move_to_preset(self, preset_id) -> bool:
+        """Aim the camera at a preset, return True if the cam accepted the command."""
+        return await self._perform_move_to_preset(preset_id)
+
+    async def async_speak(self, language, sentence) -> bool:
+        """Speak a sentence, return True if the cam accepted the command."""
+        if self._hack_name not in (MSTAR, ALLWINNER, ALLWINNERV2):
+            _LOGGER.error("Speak is not available on %s", self._name)
+            return False
+        return await self._perform_speak(language, sentence)
+
+    async def async_reboot(self) -> bool:
+        """Reboot the camera, return True if the cam accepted the command."""
+        return await self._perform_reboot()
+
+    async def async_wait_online(self):
+        """Wait for the birth message of the camera."""
+        await self._online.wait()
+
+    async def async_search_recordings(
+        self, start: dt.datetime, end: dt.datetime
+    ) -> list[tuple[dt.datetime, str, str, Recording]] | None:
+        """Return the recordings started between start and end, oldest first, with the device name."""
+        recordings = get_recordings(self.hass, self._device_name)
+        if recordings is None:
+            return None
+        found = await recordings.async_search(start, end)
+        if found is None:
+            return None
+        return [(started, self._device_name, dir_path, recording) for started, dir_path, recording in found]
 
     @property
     def brand(self):
@@ -469,6 +723,7 @@ class YiHackMqttCamera(Camera):
         self._password = config.data[CONF_PASSWORD]
         self._image_topic = config.data[CONF_MQTT_PREFIX] + "/" + config.data[CONF_TOPIC_MOTION_DETECTION_IMAGE]
         self._last_image = None
+        self._motion_images = get_motion_images(hass, self._device_name)
         self._mqtt_subscription = None
         self._mqtt_image_subscription = None
         self._mqtt_cmnd_topic = config.data[CONF_MQTT_PREFIX] + "/cmnd/camera/switch_on"
@@ -510,7 +765,7 @@ class YiHackMqttCamera(Camera):
             """Handle new MQTT messages."""
             data = msg.payload
 
-            self._last_image = data
+            self._last_image = self._motion_images.add(data)
 
         self._mqtt_image_subscription = await mqtt.async_subscribe(
             self.hass, self._image_topic, image_message_received, 1, None
@@ -547,7 +802,18 @@ class YiHackMqttCamera(Camera):
     ) -> bytes | None:
         """Return image response."""
         """Ignore width and height: camera component will resize it."""
-        return self._last_image
+        if self._last_image is None:
+            return None
+        return self._last_image.content
+
+    async def async_camera_image_etag(
+        self, width: int | None = None, height: int | None = None, max_age: float | None = None
+    ) -> tuple[bytes, str] | None:
+        """Return the last image and its ETag."""
+        """The motion image is not refreshed on demand: max_age is ignored."""
+        if self._last_image is None:
+            return None
+        return self._last_image.content, self._last_image.etag
 
     @property
     def brand(self):
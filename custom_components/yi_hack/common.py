@@ -1,108 +1,645 @@
 """Common utils for yi-hack cam."""
 
-from datetime import timedelta
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+import hashlib
+import heapq
+import itertools
+import json
 import logging
+import time
+from typing import Any
 
-import requests
-from requests.auth import HTTPBasicAuth
+import aiohttp
+from aiohttp import BasicAuth
 
 from homeassistant.const import (
     CONF_HOST,
-    CONF_NAME,
     CONF_PASSWORD,
     CONF_PORT,
     CONF_USERNAME,
 )
-from homeassistant.util import dt as dt_util
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import (
+    BREAKER_BACKOFF,
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_MAX_BACKOFF,
+    BREAKER_OPEN,
+    BREAKER_THRESHOLD,
+    DATA_API,
+    DATA_MOTION_IMAGES,
+    DATA_SNAPSHOT_CACHE,
+    DATA_SNAPSHOT_STATS,
     DOMAIN,
     HTTP_TIMEOUT,
+    LATENCY_SAMPLES,
+    MAX_CONCURRENT_BULK,
+    MAX_CONCURRENT_REQUESTS,
+    MIN_REQUEST_TIMEOUT,
+    PRIORITY_BULK,
+    PRIORITY_NORMAL,
+    SNAPSHOT_CACHE_MAX_IMAGES,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+# Errors reading the response of a cam
+CAM_READ_ERRORS = (
+    aiohttp.ClientPayloadError,
+    aiohttp.ServerDisconnectedError,
+    aiohttp.ServerTimeoutError,
+    asyncio.TimeoutError,
+)
+
 
-def get_status(config):
-    """Get system status from camera."""
-    host = config[CONF_HOST]
-    port = config[CONF_PORT]
-    user = config[CONF_USERNAME]
-    password = config[CONF_PASSWORD]
-    error = False
+class YiHackUnavailableError(aiohttp.ClientConnectionError):
+    """The cam is known to be down and the request was not sent."""
 
-    auth = None
-    if user or password:
-        auth = HTTPBasicAuth(user, password)
 
-    response = None
-    try:
-        response = requests.get("http://" + host + ":" + str(port) + "/cgi-bin/status.json", timeout=HTTP_TIMEOUT, auth=auth)
-        if response.status_code >= 300:
-            _LOGGER.error("Failed to get status from device %s", host)
-            error = True
-    except requests.exceptions.RequestException as e:
-        _LOGGER.error("Failed to get status from device %s: error %s", host, e)
-        error = True
-
-    if error:
-        response = None
+class CircuitBreaker:
+    """Track the failures of a cam and stop calling it while it is down.
+
+    After BREAKER_THRESHOLD consecutive failures the breaker opens and
+    requests fail immediately. When the backoff expires a single probe is
+    let through (half open): a success closes the breaker, a failure opens
+    it again with a doubled backoff.
+    """
+
+    def __init__(self, host: str) -> None:
+        """Initialize the breaker."""
+        self._host = host
+        self.failures = 0
+        self.backoff = BREAKER_BACKOFF
+        self._open_until = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """Return the state of the breaker."""
+        if self.failures < BREAKER_THRESHOLD:
+            return BREAKER_CLOSED
+        if time.monotonic() < self._open_until:
+            return BREAKER_OPEN
+        return BREAKER_HALF_OPEN
+
+    def allow(self) -> bool:
+        """Return True if a request can be sent to the cam."""
+        state = self.state
+        if state == BREAKER_CLOSED:
+            return True
+        if state == BREAKER_OPEN or self._probing:
+            return False
+
+        self._probing = True
+        return True
+
+    def release(self) -> None:
+        """Release the half open probe slot."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        """Close the breaker."""
+        if self.failures >= BREAKER_THRESHOLD:
+            _LOGGER.info("Device %s is reachable again", self._host)
+        self.failures = 0
+        self.backoff = BREAKER_BACKOFF
+        self._probing = False
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the breaker when needed."""
+        self._probing = False
+        self.failures += 1
+        if self.failures == BREAKER_THRESHOLD:
+            _LOGGER.warning("Device %s is unreachable, pausing requests for %ss", self._host, self.backoff)
+        elif self.failures > BREAKER_THRESHOLD:
+            self.backoff = min(self.backoff * 2, BREAKER_MAX_BACKOFF)
+        if self.failures >= BREAKER_THRESHOLD:
+            self._open_until = time.monotonic() + self.backoff
+
+    def trip(self) -> None:
+        """Open the breaker, the cam reported that it is offline."""
+        self.failures = max(self.failures, BREAKER_THRESHOLD)
+        self._open_until = time.monotonic() + self.backoff
+        self._probing = False
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the breaker status."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "backoff": self.backoff,
+        }
+
+
+class RequestScheduler:
+    """Limit the concurrent requests to a cam, serving the most urgent first.
+
+    Waiters are started by priority (lower first), then by arrival. Bulk
+    requests may hold only MAX_CONCURRENT_BULK slots, so a long download
+    never blocks interactive commands.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the scheduler."""
+        self._active = 0
+        self._active_bulk = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of requests waiting for a slot."""
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def async_acquire(self, priority: int) -> None:
+        """Wait for a free slot, release() must be called when done."""
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was assigned just before the cancellation
+                self._finish(priority)
+            raise
+
+        wait = time.monotonic() - start
+        self.requests += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def release(self, priority: int) -> None:
+        """Free a slot taken with async_acquire()."""
+        self._finish(priority)
+
+    def _dispatch(self) -> None:
+        """Start the waiters while there are free slots."""
+        skipped = []
+        while self._waiters and self._active < MAX_CONCURRENT_REQUESTS:
+            item = heapq.heappop(self._waiters)
+            priority, _, future = item
+            if future.done():
+                continue
+            if priority >= PRIORITY_BULK:
+                if self._active_bulk >= MAX_CONCURRENT_BULK:
+                    skipped.append(item)
+                    continue
+                self._active_bulk += 1
+            self._active += 1
+            future.set_result(None)
+
+        for item in skipped:
+            heapq.heappush(self._waiters, item)
+
+    def _finish(self, priority: int) -> None:
+        """Free a slot."""
+        self._active -= 1
+        if priority >= PRIORITY_BULK:
+            self._active_bulk -= 1
+        self._dispatch()
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the scheduler metrics."""
+        return {
+            "active": self._active,
+            "active_bulk": self._active_bulk,
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "average_wait": round(self.total_wait / self.requests, 3) if self.requests else 0,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+
+class YiHackApi:
+    """Async client for the cgi-bin interface of a yi-hack cam.
+
+    All the clients share the Home Assistant aiohttp session: its connector
+    keeps a pool of keep-alive connections for every host, so no request
+    needs a new TCP connection or an executor thread.
+    """
+
+    def __init__(self, hass: HomeAssistant, config) -> None:
+        """Initialize the client."""
+        self.hass = hass
+        self.host = config[CONF_HOST]
+        self.port = config[CONF_PORT]
+        self.session = async_get_clientsession(hass)
+        self.base_url = "http://" + self.host + ":" + str(self.port)
+        self.breaker = CircuitBreaker(self.host)
+        self.scheduler = RequestScheduler()
+        self._inflight: dict[tuple[str, str], asyncio.Task] = {}
+        self.coalesced = 0
+
+        self.auth = None
+        if config[CONF_USERNAME] or config[CONF_PASSWORD]:
+            self.auth = BasicAuth(config[CONF_USERNAME], config[CONF_PASSWORD])
+
+    @property
+    def available(self) -> bool:
+        """Return False while the circuit breaker is open."""
+        return self.breaker.state != BREAKER_OPEN
+
+    def url(self, path: str) -> str:
+        """Return the full url of a path on the cam."""
+        return self.base_url + "/" + path.lstrip("/")
+
+    @asynccontextmanager
+    async def async_open(
+        self,
+        method: str,
+        path: str,
+        timeout: float | None = HTTP_TIMEOUT,
+        priority: int = PRIORITY_NORMAL,
+        **kwargs: Any,
+    ):
+        """Open a request to the cam and yield the response.
+
+        The timeout includes the wait for a free slot. A timeout of None only
+        limits the wait, connect and read of each chunk, use it for long
+        streams: they give their slot back as soon as the cam answers, so a
+        playing video doesn't hold back the other requests.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (HTTP_TIMEOUT if timeout is None else timeout)
+        async with asyncio.timeout_at(deadline):
+            await self.scheduler.async_acquire(priority)
+
+        slot = True
+        try:
+            if timeout is not None:
+                timeout = max(deadline - loop.time(), MIN_REQUEST_TIMEOUT)
+            async with self._async_open(method, path, timeout, **kwargs) as response:
+                if timeout is None:
+                    self.scheduler.release(priority)
+                    slot = False
+                yield response
+        finally:
+            if slot:
+                self.scheduler.release(priority)
+
+    @asynccontextmanager
+    async def _async_open(self, method, path, timeout, **kwargs):
+        """Open a request to the cam, guarded by the circuit breaker."""
+        if not self.breaker.allow():
+            raise YiHackUnavailableError("device " + self.host + " is unavailable")
+
+        if timeout is None:
+            client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_TIMEOUT, sock_read=HTTP_TIMEOUT)
+        else:
+            client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+        try:
+            try:
+                response = await self.session.request(
+                    method,
+                    self.url(path),
+                    auth=self.auth,
+                    timeout=client_timeout,
+                    **kwargs,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.breaker.record_failure()
+                raise
+
+            self.breaker.record_success()
+            async with response:
+                try:
+                    yield response
+                except CAM_READ_ERRORS:
+                    # Only reading the cam failed: errors writing to a client
+                    # (e.g. a closed video tab) say nothing about the cam
+                    self.breaker.record_failure()
+                    raise
+        finally:
+            self.breaker.release()
+
+    async def async_request(
+        self,
+        method: str,
+        path: str,
+        data: Any = None,
+        headers: dict[str, str] | None = None,
+        timeout: float = HTTP_TIMEOUT,
+        priority: int = PRIORITY_NORMAL,
+        shared: bool = False,
+    ) -> bytes | None:
+        """Send a request to the cam and return the body, None on error.
+
+        With shared=True concurrent calls for the same method and path are
+        served by a single request to the cam: use it only for requests
+        without side effects.
+        """
+        if not shared:
+            return await self._async_request(method, path, data, headers, timeout, priority)
+
+        key = (method, path)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self.hass.async_create_task(
+                self._async_request(method, path, data, headers, timeout, priority)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # A cancelled caller must not cancel the request of the others
+        return await asyncio.shield(task)
+
+    async def _async_request(self, method, path, data, headers, timeout, priority):
+        """Send a request to the cam."""
+        try:
+            async with self.async_open(method, path, timeout=timeout, priority=priority, data=data, headers=headers) as response:
+                if response.status >= 300:
+                    _LOGGER.error("Failed to call %s on device %s: status %s", path, self.host, response.status)
+                    return None
+                return await response.read()
+        except YiHackUnavailableError as error:
+            _LOGGER.debug("Skip %s: %s", path, error)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            _LOGGER.error("Failed to call %s on device %s: error %s", path, self.host, error)
+
         return None
 
-    return response.json()
+    async def async_get_json(
+        self,
+        path: str,
+        method: str = "GET",
+        data: Any = None,
+        priority: int = PRIORITY_NORMAL,
+        shared: bool = False,
+    ) -> Any:
+        """Send a request to the cam and decode the json body, None on error."""
+        body = await self.async_request(method, path, data=data, priority=priority, shared=shared)
+        if body is None:
+            return None
+
+        try:
+            return json.loads(body)
+        except ValueError as error:
+            _LOGGER.error("Invalid response from %s on device %s: error %s", path, self.host, error)
+
+        return None
 
-def get_system_conf(config):
-    """Get system configuration from camera."""
-    host = config[CONF_HOST]
-    port = config[CONF_PORT]
-    user = config[CONF_USERNAME]
-    password = config[CONF_PASSWORD]
-    error = False
+    async def async_get_status(self):
+        """Get system status from camera."""
+        return await self.async_get_json("cgi-bin/status.json", shared=True)
 
-    auth = None
-    if user or password:
-        auth = HTTPBasicAuth(user, password)
+    async def async_get_system_conf(self):
+        """Get system configuration from camera."""
+        return await self.async_get_json("cgi-bin/get_configs.sh?conf=system", shared=True)
 
-    response = None
+    async def async_get_mqtt_conf(self):
+        """Get mqtt configuration from camera."""
+        return await self.async_get_json("cgi-bin/get_configs.sh?conf=mqtt", shared=True)
+
+
+class SnapshotCache:
+    """Share the last snapshots of a cam between the viewers for a few seconds.
+
+    Images are stored by key, e.g. resolution or requested size, and are all
+    dropped together. Concurrent callers that miss the cache wait for the
+    same fetch. Expired images are dropped, and only the most recently used
+    SNAPSHOT_CACHE_MAX_IMAGES are kept, whatever sizes the clients ask for.
+    """
+
+    def __init__(self, hass: HomeAssistant, ttl: float) -> None:
+        """Initialize the cache."""
+        self._hass = hass
+        self.ttl = ttl
+        self._images: OrderedDict[Any, tuple[bytes, float]] = OrderedDict()
+        self._generation = 0
+        self._tasks: dict[Any, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def age(self, key: Any = None) -> float | None:
+        """Return the seconds since the image was taken."""
+        if key not in self._images:
+            return None
+        return time.monotonic() - self._images[key][1]
+
+    def invalidate(self) -> None:
+        """Drop the images, the next calls will fetch new ones."""
+        self._images.clear()
+        self._generation += 1
+
+    async def async_get(self, fetch, max_age: float | None = None, key: Any = None) -> bytes | None:
+        """Return the cached image if younger than max_age (at most the TTL), else fetch it."""
+        if max_age is None:
+            max_age = self.ttl
+
+        self._drop_expired()
+        age = self.age(key)
+        if age is not None and age < max_age:
+            self.hits += 1
+            self._images.move_to_end(key)
+            return self._images[key][0]
+
+        self.misses += 1
+        if key not in self._tasks:
+            self._tasks[key] = self._hass.async_create_task(self._async_fetch(fetch, key))
+
+        return await asyncio.shield(self._tasks[key])
+
+    async def _async_fetch(self, fetch, key: Any) -> bytes | None:
+        """Fetch and store a new image."""
+        generation = self._generation
+        try:
+            image = await fetch()
+        finally:
+            del self._tasks[key]
+
+        # Don't keep an image taken before an invalidation
+        if image is not None and generation == self._generation:
+            self._images[key] = (image, time.monotonic())
+            self._images.move_to_end(key)
+            while len(self._images) > SNAPSHOT_CACHE_MAX_IMAGES:
+                self._images.popitem(last=False)
+
+        return image
+
+    def _drop_expired(self) -> None:
+        """Drop the images older than the TTL."""
+        now = time.monotonic()
+        for key in [key for key, (_, taken) in self._images.items() if now - taken >= self.ttl]:
+            del self._images[key]
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the cache metrics."""
+        return {
+            "ttl": self.ttl,
+            "images": {
+                str(key): round(self.age(key), 3) for key in self._images
+            },
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class LatencyStats:
+    """Keep the latest durations and the outcomes of an operation."""
+
+    def __init__(self) -> None:
+        """Initialize the statistics."""
+        self._samples: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.successes = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.wins = 0
+
+    def add(self, duration: float, success: bool) -> None:
+        """Record the duration of a successful or failed operation."""
+        if success:
+            self.successes += 1
+            self._samples.append(duration)
+        else:
+            self.failures += 1
+
+    def add_cancelled(self, duration: float) -> None:
+        """Record the time spent by an operation cancelled before its end, a lower bound of its duration."""
+        self.cancelled += 1
+        self._samples.append(duration)
+
+    def percentile(self, fraction: float) -> float | None:
+        """Return a percentile of the latest successful or cancelled durations."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the statistics."""
+        p50 = self.percentile(0.5)
+        p90 = self.percentile(0.9)
+        return {
+            "successes": self.successes,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "wins": self.wins,
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p90": round(p90, 3) if p90 is not None else None,
+        }
+
+
+@dataclass
+class MotionImage:
+    """An image published by a cam when a motion is detected."""
+
+    id: int
+    timestamp: float
+    content: bytes
+    etag: str
+
+
+class MotionImageBuffer:
+    """Keep the latest motion images of a cam, bounded in count and in bytes."""
+
+    def __init__(self, max_count: int, max_bytes: int) -> None:
+        """Initialize the buffer."""
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._images: deque[MotionImage] = deque()
+        self._size = 0
+        self._ids = itertools.count(1)
+
+    def __iter__(self):
+        """Iterate over the images, the oldest first."""
+        return iter(self._images)
+
+    def add(self, content: bytes) -> MotionImage:
+        """Store a new image, dropping the oldest ones when full."""
+        image = MotionImage(next(self._ids), time.time(), content, content_etag(content))
+        self._images.append(image)
+        self._size += len(content)
+        while len(self._images) > 1 and (
+            len(self._images) > self._max_count or self._size > self._max_bytes
+        ):
+            self._size -= len(self._images.popleft().content)
+        return image
+
+    def get(self, image_id: int) -> MotionImage | None:
+        """Return an image by id."""
+        for image in self._images:
+            if image.id == image_id:
+                return image
+        return None
+
+    def latest(self, before: float | None = None) -> MotionImage | None:
+        """Return the latest image, or the latest one taken before a timestamp."""
+        for image in reversed(self._images):
+            if before is None or image.timestamp <= before:
+                return image
+        return None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the buffer usage."""
+        return {
+            "images": len(self._images),
+            "bytes": self._size,
+        }
+
+
+def content_etag(content: bytes) -> str:
+    """Return a strong ETag for some content."""
+    return '"' + hashlib.blake2b(content, digest_size=8).hexdigest() + '"'
+
+
+class ETagCache:
+    """Remember the ETag of the last image, so each image is hashed once."""
+
+    def __init__(self) -> None:
+        """Initialize the cache."""
+        self._content: bytes | None = None
+        self._etag: str | None = None
+
+    def get(self, content: bytes) -> str:
+        """Return the ETag of an image."""
+        if content is not self._content:
+            self._content = content
+            self._etag = content_etag(content)
+        return self._etag
+
+
+def get_api(hass: HomeAssistant, device_name: str) -> YiHackApi | None:
+    """Return the client of a configured cam, None if it is not loaded."""
     try:
-        response = requests.get("http://" + host + ":" + str(port) + "/cgi-bin/get_configs.sh?conf=system", timeout=HTTP_TIMEOUT, auth=auth)
-        if response.status_code >= 300:
-            _LOGGER.error("Failed to get system configuration from device %s", host)
-            error = True
-    except requests.exceptions.RequestException as e:
-        _LOGGER.error("Failed to get system configuration from device %s: error %s", host, e)
-        error = True
-
-    if error:
-        response = None
+        return hass.data[DOMAIN][device_name][DATA_API]
+    except KeyError:
         return None
 
-    return response.json()
 
-def get_mqtt_conf(config):
-    """Get mqtt configuration from camera."""
-    host = config[CONF_HOST]
-    port = config[CONF_PORT]
-    user = config[CONF_USERNAME]
-    password = config[CONF_PASSWORD]
-    error = False
+def get_snapshot_cache(hass: HomeAssistant, device_name: str) -> SnapshotCache | None:
+    """Return the snapshot cache of a configured cam, None if it is not loaded."""
+    try:
+        return hass.data[DOMAIN][device_name][DATA_SNAPSHOT_CACHE]
+    except KeyError:
+        return None
 
-    auth = None
-    if user or password:
-        auth = HTTPBasicAuth(user, password)
 
-    response = None
+def get_snapshot_stats(hass: HomeAssistant, device_name: str) -> dict[str, LatencyStats] | None:
+    """Return the snapshot statistics of a configured cam, None if it is not loaded."""
     try:
-        response = requests.get("http://" + host + ":" + str(port) + "/cgi-bin/get_configs.sh?conf=mqtt", timeout=HTTP_TIMEOUT, auth=auth)
-        if response.status_code >= 300:
-            _LOGGER.error("Failed to get mqtt configuration from device %s", host)
-            error = True
-    except requests.exceptions.RequestException as e:
-        _LOGGER.error("Failed to get mqtt configuration from device %s: error %s", host, e)
-        error = True
-
-    if error:
-        response = None
+        return hass.data[DOMAIN][device_name][DATA_SNAPSHOT_STATS]
+    except KeyError:
         return None
 
-    return response.json()
+
+def get_motion_images(hass: HomeAssistant, device_name: str) -> MotionImageBuffer | None:
+    """Return the motion images of a configured cam, None if it is not loaded."""
+    try:
+        return hass.data[DOMAIN][device_name][DATA_MOTION_IMAGES]
+    except KeyError:
+        return None
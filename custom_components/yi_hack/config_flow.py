@@ -9,20 +9,27 @@ from homeassistant.components import zeroconf
 from homeassistant.components.ffmpeg import CONF_EXTRA_ARGUMENTS
 from homeassistant.const import (CONF_HOST, CONF_MAC, CONF_NAME, CONF_PASSWORD,
                                  CONF_PORT, CONF_USERNAME)
+from homeassistant.core import callback
 from homeassistant.helpers.device_registry import format_mac
 from homeassistant.helpers.service_info.zeroconf import ZeroconfServiceInfo
 
 from typing import Any
 
-from .common import get_status
+from .common import YiHackApi
 from .const import (ALLWINNER, ALLWINNER_R, ALLWINNERV2, ALLWINNERV2_R,
-                    CONF_BOOST_SPEAKER, CONF_HACK_NAME, CONF_MQTT_PREFIX,
+                    CONF_BOOST_SPEAKER, CONF_FRAME_GRABBER, CONF_HACK_NAME,
+                    CONF_MQTT_PREFIX,
                     CONF_PTZ, CONF_RTSP_PORT, CONF_SERIAL,
+                    CONF_SNAPSHOT_HEDGE, CONF_SNAPSHOT_HEDGE_DELAY,
+                    CONF_SNAPSHOT_REFRESH_ON_MOTION, CONF_SNAPSHOT_TTL,
                     CONF_TOPIC_MOTION_DETECTION,
                     CONF_TOPIC_MOTION_DETECTION_IMAGE,
                     CONF_TOPIC_SOUND_DETECTION, CONF_TOPIC_STATUS,
                     DEFAULT_BRAND, DEFAULT_BRAND_R, DEFAULT_EXTRA_ARGUMENTS,
+                    DEFAULT_FRAME_GRABBER,
                     DEFAULT_HOST, DEFAULT_PASSWORD, DEFAULT_PORT,
+                    DEFAULT_SNAPSHOT_HEDGE, DEFAULT_SNAPSHOT_HEDGE_DELAY,
+                    DEFAULT_SNAPSHOT_REFRESH_ON_MOTION, DEFAULT_SNAPSHOT_TTL,
                     DEFAULT_USERNAME, DOMAIN, MSTAR, MSTAR_R, SONOFF, SONOFF_R,
                     V5, V5_R)
 
@@ -60,6 +67,14 @@ class YiHackFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         """Set up the instance."""
         self.connection_data: dict[str, Any] = {}
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Get the options flow for this handler."""
+        return YiHackOptionsFlowHandler()
+
     async def async_process_input(
         self, user_input: dict[str, Any] | None = None
     ) -> ConfigFlowResult:
@@ -73,7 +88,7 @@ class YiHackFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         extra_arguments = user_input[CONF_EXTRA_ARGUMENTS]
         boost_speaker = user_input[CONF_BOOST_SPEAKER]
 
-        response = await self.hass.async_add_executor_job(get_status, user_input)
+        response = await YiHackApi(self.hass, user_input).async_get_status()
         if response is not None:
             try:
                 serial_number = response["serial_number"]
@@ -220,3 +235,43 @@ class YiHackFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             data_schema=vol.Schema(DATA_SCHEMA_ZC),
             errors=errors,
         )
+
+
+class YiHackOptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle yi-hack options."""
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> ConfigFlowResult:
+        """Manage the options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self.config_entry.options
+        data_schema = {
+            vol.Required(
+                CONF_SNAPSHOT_TTL,
+                default=options.get(CONF_SNAPSHOT_TTL, DEFAULT_SNAPSHOT_TTL),
+            ): vol.All(vol.Coerce(float), vol.Range(min=0, max=600)),
+            vol.Required(
+                CONF_SNAPSHOT_REFRESH_ON_MOTION,
+                default=options.get(CONF_SNAPSHOT_REFRESH_ON_MOTION, DEFAULT_SNAPSHOT_REFRESH_ON_MOTION),
+            ): bool,
+            vol.Required(
+                CONF_SNAPSHOT_HEDGE,
+                default=options.get(CONF_SNAPSHOT_HEDGE, DEFAULT_SNAPSHOT_HEDGE),
+            ): bool,
+            vol.Required(
+                CONF_SNAPSHOT_HEDGE_DELAY,
+                default=options.get(CONF_SNAPSHOT_HEDGE_DELAY, DEFAULT_SNAPSHOT_HEDGE_DELAY),
+            ): vol.All(vol.Coerce(float), vol.Range(min=0.2, max=10)),
+            vol.Required(
+                CONF_FRAME_GRABBER,
+                default=options.get(CONF_FRAME_GRABBER, DEFAULT_FRAME_GRABBER),
+            ): bool,
+        }
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=vol.Schema(data_schema),
+        )
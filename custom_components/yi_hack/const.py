@@ -26,9 +26,74 @@ SERVICE_PTZ = "ptz"
 SERVICE_MOVE_TO_PRESET = "move_to_preset"
 SERVICE_SPEAK = "speak"
 SERVICE_REBOOT = "reboot"
+SERVICE_PTZ_START = "ptz_start"
+SERVICE_PTZ_STOP = "ptz_stop"
+SERVICE_BULK_REBOOT = "bulk_reboot"
+SERVICE_BULK_MOVE_TO_PRESET = "bulk_move_to_preset"
+SERVICE_BULK_SPEAK = "bulk_speak"
+DEFAULT_BULK_PARALLELISM = 4
+DEFAULT_BULK_TIMEOUT = 180
+SERVICE_SEARCH_RECORDINGS = "search_recordings"
+DEFAULT_SEARCH_LIMIT = 500
 
 HTTP_TIMEOUT = 10
 
+BREAKER_THRESHOLD = 3
+BREAKER_BACKOFF = 5
+BREAKER_MAX_BACKOFF = 300
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+MAX_CONCURRENT_REQUESTS = 2
+MAX_CONCURRENT_BULK = 1
+MIN_REQUEST_TIMEOUT = 1
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+MJPEG_BOUNDARY = b"--ffmpeg"
+MJPEG_CLIENT_BUFFER = 2
+MJPEG_GRACE_PERIOD = 10
+MJPEG_MAX_FRAME_SIZE = 4 * 1024 * 1024
+GRABBER_MAX_AGE = 5
+GRABBER_RECONNECT_DELAY = 5
+GRABBER_MAX_RECONNECT_DELAY = 60
+
+PTZ_MAX_TRAVEL_TIME = 5.0
+PTZ_CONTINUOUS_STEP = 0.5
+PTZ_CONTINUOUS_MAX_TIME = 30
+
+AUDIO_CHUNK_SIZE = 4096
+# busybox httpd gives the CGI scripts only Content-Length bytes of the body
+SPEAKER_CHUNKED_UPLOAD = False
+PCM_CACHE_CHUNK_SIZE = 65536
+PCM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+PCM_CACHE_MAX_SOURCE_BYTES = 20 * 1024 * 1024
+
+MOTION_IMAGES_MAX_COUNT = 50
+MOTION_IMAGES_MAX_BYTES = 10 * 1024 * 1024
+
+DATA_API = "api"
+DATA_SETUP_TIMINGS = "setup_timings"
+DATA_SNAPSHOT_CACHE = "snapshot_cache"
+DATA_SNAPSHOT_STATS = "snapshot_stats"
+DATA_MJPEG_HUB = "mjpeg_hub"
+DATA_FRAME_GRABBER = "frame_grabber"
+DATA_MOTION_IMAGES = "motion_images"
+DATA_PTZ_QUEUE = "ptz_queue"
+DATA_PCM_CACHE = DOMAIN + "_pcm_cache"
+DATA_RECORDINGS = "recordings"
+
+STORAGE_KEY = DOMAIN + ".config"
+STORAGE_VERSION = 1
+RECORDINGS_STORAGE_KEY = DOMAIN + ".recordings"
+RECORDINGS_SAVE_DELAY = 30
+RECORDINGS_REFRESH_INTERVAL = 60
+RECORDINGS_FULL_REFRESH_INTERVAL = 86400
+BROWSE_PAGE_SIZE = 48
+BROWSE_TIMELINE_TIMEOUT = 10
+
 CONF_HACK_NAME = "HACK_NAME"
 CONF_SERIAL = "SERIAL_NUMBER"
 CONF_PTZ = "PTZ"
@@ -51,5 +116,24 @@ CONF_BIRTH_MSG = "BIRTH_MSG"
 CONF_WILL_MSG = "WILL_MSG"
 CONF_SOUND_DETECTION_MSG = "SOUND_DETECTION_MSG"
 
+CONF_SNAPSHOT_TTL = "snapshot_ttl"
+CONF_SNAPSHOT_REFRESH_ON_MOTION = "snapshot_refresh_on_motion"
+DEFAULT_SNAPSHOT_TTL = 5
+DEFAULT_SNAPSHOT_REFRESH_ON_MOTION = True
+CONF_SNAPSHOT_HEDGE = "snapshot_hedge"
+CONF_SNAPSHOT_HEDGE_DELAY = "snapshot_hedge_delay"
+DEFAULT_SNAPSHOT_HEDGE = False
+DEFAULT_SNAPSHOT_HEDGE_DELAY = 2.0
+MIN_SNAPSHOT_HEDGE_DELAY = 0.2
+CONF_FRAME_GRABBER = "frame_grabber"
+DEFAULT_FRAME_GRABBER = False
+LATENCY_SAMPLES = 50
+SNAPSHOT_CACHE_MAX_IMAGES = 8
+
 LINK_LOW_RES_STREAM = "low_res_stream"
 LINK_HIGH_RES_STREAM = "high_res_stream"
+
+RES_HIGH = "high"
+RES_LOW = "low"
+LOW_RES_WIDTH = 640
+LOW_RES_HEIGHT = 360
@@ -0,0 +1,48 @@
+"""Diagnostics support for yi-hack."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_MAC, CONF_NAME, CONF_PASSWORD, CONF_USERNAME
+from homeassistant.core import HomeAssistant
+
+from .const import (CONF_SERIAL, DATA_API, DATA_FRAME_GRABBER, DATA_MJPEG_HUB,
+                    DATA_MOTION_IMAGES, DATA_PCM_CACHE, DATA_PTZ_QUEUE,
+                    DATA_RECORDINGS, DATA_SETUP_TIMINGS, DATA_SNAPSHOT_CACHE,
+                    DATA_SNAPSHOT_STATS, DOMAIN)
+
+TO_REDACT = {CONF_MAC, CONF_PASSWORD, CONF_SERIAL, CONF_USERNAME}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    data = hass.data.get(DOMAIN, {}).get(entry.data[CONF_NAME], {})
+    api = data.get(DATA_API)
+    snapshot_cache = data.get(DATA_SNAPSHOT_CACHE)
+    snapshot_stats = data.get(DATA_SNAPSHOT_STATS, {})
+    mjpeg_hub = data.get(DATA_MJPEG_HUB)
+    frame_grabber = data.get(DATA_FRAME_GRABBER)
+    motion_images = data.get(DATA_MOTION_IMAGES)
+    ptz_queue = data.get(DATA_PTZ_QUEUE)
+    pcm_cache = hass.data.get(DATA_PCM_CACHE)
+    recordings = data.get(DATA_RECORDINGS)
+
+    return {
+        "entry": async_redact_data(entry.data, TO_REDACT),
+        "setup_timings": data.get(DATA_SETUP_TIMINGS),
+        "circuit_breaker": api.breaker.as_dict() if api is not None else None,
+        "coalesced_requests": api.coalesced if api is not None else None,
+        "scheduler": api.scheduler.as_dict() if api is not None else None,
+        "snapshot_cache": snapshot_cache.as_dict() if snapshot_cache is not None else None,
+        "snapshot_latency": {path: stats.as_dict() for path, stats in snapshot_stats.items()},
+        "mjpeg_hub": mjpeg_hub.as_dict() if mjpeg_hub is not None else None,
+        "frame_grabber": frame_grabber.as_dict() if frame_grabber is not None else None,
+        "motion_images": motion_images.as_dict() if motion_images is not None else None,
+        "ptz_queue": ptz_queue.as_dict() if ptz_queue is not None else None,
+        "pcm_cache": pcm_cache.as_dict() if pcm_cache is not None else None,
+        "recordings": recordings.as_dict() if recordings is not None else None,
+    }
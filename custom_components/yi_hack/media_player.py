@@ -2,15 +2,14 @@
 from __future__ import annotations
 
 import asyncio
+from collections.abc import AsyncIterator
 import logging
 import subprocess
-import threading
 
-import requests
-from requests.auth import HTTPBasicAuth
 from typing import Any
 
 from homeassistant.components import media_source
+from homeassistant.components.ffmpeg import DATA_FFMPEG
 from homeassistant.components.media_player import (
     BrowseMedia,
     MediaType,
@@ -35,15 +34,19 @@ from homeassistant.const import (
 )
 from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 
+from .audio import get_pcm_cache
+from .common import get_api
 from .const import (
     ALLWINNER,
     ALLWINNERV2,
+    AUDIO_CHUNK_SIZE,
     CONF_BOOST_SPEAKER,
     CONF_HACK_NAME,
     DEFAULT_BRAND,
     DOMAIN,
-    HTTP_TIMEOUT,
-    MSTAR
+    MSTAR,
+    PRIORITY_INTERACTIVE,
+    SPEAKER_CHUNKED_UPLOAD
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -51,7 +54,7 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up the Yi Camera media player from a config entry."""
     if (config_entry.data[CONF_HACK_NAME] == MSTAR) or (config_entry.data[CONF_HACK_NAME] == ALLWINNER) or (config_entry.data[CONF_HACK_NAME] == ALLWINNERV2):
-        async_add_entities([YiHackMediaPlayer(config_entry)], True)
+        async_add_entities([YiHackMediaPlayer(hass, config_entry)], True)
 
 
 class YiHackMediaPlayer(MediaPlayerEntity):
@@ -63,7 +66,7 @@ class YiHackMediaPlayer(MediaPlayerEntity):
         | MediaPlayerEntityFeature.PLAY_MEDIA
     )
 
-    def __init__(self, config):
+    def __init__(self, hass, config):
         """Initialize the device."""
         self._device_name = config.data[CONF_NAME]
         self._name = self._device_name + " " + "Media Player"
@@ -74,9 +77,10 @@ class YiHackMediaPlayer(MediaPlayerEntity):
         self._user = config.data[CONF_USERNAME]
         self._password = config.data[CONF_PASSWORD]
         self._hack_name = config.data[CONF_HACK_NAME]
+        self._api = get_api(hass, self._device_name)
         # Assume that the media player is not in Play mode
         self._state = None
-        self._playing = threading.Lock()
+        self._playing = asyncio.Lock()
         try:
             self._boost_speaker = config.data[CONF_BOOST_SPEAKER]
         except KeyError:
@@ -133,39 +137,6 @@ class YiHackMediaPlayer(MediaPlayerEntity):
     ) -> None:
         """Send the play_media command to the media player."""
 
-        def _perform_speaker(data):
-            auth = None
-            if self._user or self._password:
-                auth = HTTPBasicAuth(self._user, self._password)
-
-            self._playing.acquire()
-
-            response = None
-
-            try:
-                url_speaker = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speaker.sh"
-                if self._boost_speaker == "auto":
-                    if self._hack_name == MSTAR:
-                        url_speaker = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speaker.sh?vol=4";
-                    elif self._hack_name == ALLWINNERV2:
-                        url_speaker = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speaker.sh?vol=3";
-                elif self._boost_speaker != "disabled":
-                    url_speaker = "http://" + self._host + ":" + str(self._port) + "/cgi-bin/speaker.sh?vol=" + str(self._boost_speaker[-1]);
-
-                response = requests.post(url_speaker, data=data, timeout=HTTP_TIMEOUT, headers={'Content-Type': 'application/octet-stream'}, auth=auth)
-                if response.status_code >= 300:
-                    _LOGGER.error("Failed to send speaker command to device %s", self._host)
-            except requests.exceptions.RequestException as error:
-                _LOGGER.error("Failed to send speaker command to device %s: error %s", self._host, error)
-
-            if response is None:
-                _LOGGER.error("Failed to send speak command to device %s: error unknown", self._host)
-
-            self._playing.release()
-
-        def _perform_cmd(p_cmd):
-            return subprocess.run(p_cmd, check=False, shell=False, stdout=subprocess.PIPE).stdout
-
         if media_source.is_media_source_id(media_id):
             media_type = MediaType.MUSIC
             play_item = await media_source.async_resolve_media(self.hass, media_id)
@@ -183,13 +154,97 @@ class YiHackMediaPlayer(MediaPlayerEntity):
             _LOGGER.error("Failed to send speaker command, device %s is busy", self._host)
             return
 
-        cmd = ["ffmpeg", "-i", media_id, "-f", "s16le", "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", "-"]
-        data = await self.hass.async_add_executor_job(_perform_cmd, cmd)
-
-        if data is not None and len(data) > 0:
-            await self.hass.async_add_executor_job(_perform_speaker, data)
+        async with self._playing:
+            await self._async_play(media_id)
+
+    async def _async_play(self, media_id):
+        """Play the media from the audio cache, or transcode it."""
+        # Announcements played again skip FFmpeg
+        pcm_cache = get_pcm_cache(self.hass)
+        key = await pcm_cache.async_get_key(media_id)
+        source = None
+        if key is None:
+            # Without validators the media is downloaded once, for its hash and for FFmpeg
+            downloaded = await pcm_cache.async_download(media_id)
+            if downloaded is not None:
+                key, source = downloaded
+        try:
+            if key is not None:
+                data = await pcm_cache.async_read(key)
+                if data is not None:
+                    _LOGGER.debug("Playing %s from the audio cache", media_id)
+                    try:
+                        await self._perform_speaker(data)
+                    finally:
+                        await data.aclose()
+                    return
+
+            # The downloaded file is seekable, e.g. for an MP4 with its moov atom at the end
+            await self._async_transcode(media_id if source is None else source, key)
+        finally:
+            if source is not None:
+                await pcm_cache.async_remove_download(source)
+
+    async def _async_transcode(self, source, key):
+        """Transcode the media and send it to the speaker."""
+        pcm_cache = get_pcm_cache(self.hass)
+        cmd = ["-i", source, "-f", "s16le", "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", "-"]
+        process = await asyncio.create_subprocess_exec(
+            self.hass.data[DATA_FFMPEG].binary,
+            *cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+        )
+        try:
+            # Don't call the cam if FFmpeg can't read the media
+            first_chunk = await process.stdout.read(AUDIO_CHUNK_SIZE)
+            if not first_chunk:
+                _LOGGER.error("Failed to send data to speaker %s, no data available", self._host)
+                return
+
+            data = _iter_chunks(first_chunk, process.stdout)
+            if key is not None:
+                data = pcm_cache.async_write(key, data)
+            try:
+                await self._perform_speaker(data)
+            finally:
+                await data.aclose()
+        finally:
+            # FFmpeg may still be exiting after its last chunk, its exit code then decides on the cache
+            if process.returncode is None and not process.stdout.at_eof():
+                process.kill()
+            await process.wait()
+            if key is not None and process.returncode != 0:
+                pcm_cache.discard(key)
+
+    async def _perform_speaker(self, data):
+        url_speaker = "cgi-bin/speaker.sh"
+        if self._boost_speaker == "auto":
+            if self._hack_name == MSTAR:
+                url_speaker = "cgi-bin/speaker.sh?vol=4"
+            elif self._hack_name == ALLWINNERV2:
+                url_speaker = "cgi-bin/speaker.sh?vol=3"
+        elif self._boost_speaker != "disabled":
+            url_speaker = "cgi-bin/speaker.sh?vol=" + str(self._boost_speaker[-1])
+
+        if SPEAKER_CHUNKED_UPLOAD:
+            # The audio is sent with a chunked upload, as long as the media lasts
+            body = data
         else:
-            _LOGGER.error("Failed to send data to speaker %s, no data available", self._host)
+            # Sent with a Content-Length once FFmpeg is done, speaker.sh would
+            # read an empty stdin from a chunked upload
+            body = b"".join([chunk async for chunk in data])
+
+        response = await self._api.async_request(
+            "POST",
+            url_speaker,
+            data=body,
+            headers={'Content-Type': 'application/octet-stream'},
+            timeout=None,
+            priority=PRIORITY_INTERACTIVE,
+        )
+        if response is None:
+            _LOGGER.error("Failed to send speaker command to device %s", self._host)
 
     async def async_browse_media(
         self,
@@ -202,3 +257,11 @@ class YiHackMediaPlayer(MediaPlayerEntity):
             media_content_id,
             content_filter=lambda item: item.media_content_type.startswith("audio/"),
         )
+
+
+async def _iter_chunks(first_chunk: bytes, reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    """Yield the audio produced by FFmpeg."""
+    yield first_chunk
+    while chunk := await reader.read(AUDIO_CHUNK_SIZE):
+        yield chunk
+
@@ -1,10 +1,12 @@
 """yi-hack Media Source Implementation."""
 from __future__ import annotations
 
+import asyncio
 import datetime as dt
+import heapq
+from itertools import islice
 import logging
-import requests
-from requests.auth import HTTPBasicAuth
+from operator import itemgetter
 
 from homeassistant.components.media_player.const import (
     MediaClass,
@@ -18,19 +20,21 @@ from homeassistant.components.media_source.models import (
     MediaSourceItem,
     PlayMedia
 )
-from homeassistant.const import (
-    CONF_HOST,
-    CONF_NAME,
-    CONF_PASSWORD,
-    CONF_PORT,
-    CONF_USERNAME
-)
+from homeassistant.const import CONF_NAME
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers import device_registry as dr
 
-from .const import DEFAULT_BRAND, DOMAIN, HTTP_TIMEOUT
+from .const import (BROWSE_PAGE_SIZE, BROWSE_TIMELINE_TIMEOUT, DEFAULT_BRAND,
+                    DOMAIN)
+from .recordings import Recording, get_recordings
 
 MIME_TYPE_MP4 = "video/mp4"
+PAGE_PREFIX = "page:"
+TITLE_NEWER = "Newer"
+TITLE_OLDER = "Older"
+TIMELINE_ID = "@all"
+TITLE_TIMELINE = "All cameras"
+TIMELINE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -68,6 +72,13 @@ class YiHackMediaSource(MediaSource):
         """Return media."""
         entry_id, event_dir, event_file = async_parse_identifier(item)
 
+        # The directories and the recordings are browsed one page at a time
+        page = 0
+        if event_file is not None and event_file.startswith(PAGE_PREFIX):
+            page, event_file = _parse_page(event_file), None
+        elif event_dir is not None and event_file is None and event_dir.startswith(PAGE_PREFIX):
+            page, event_dir = _parse_page(event_dir), None
+
         if len(self._devices) == 0:
             device_registry = dr.async_get(self.hass)
             for device in device_registry.devices.values():
@@ -80,17 +91,9 @@ class YiHackMediaSource(MediaSource):
                         _LOGGER.warning("Index error about identifier")
 
 
-        return await self.hass.async_add_executor_job(self._browse_media, entry_id, event_dir)
-
-    def _browse_media(self, entry_id:str, event_dir:str) -> BrowseMediaSource:
-        error = False
-        host = ""
-        port = ""
-        user = ""
-        password = ""
-
-        response = None
+        return await self._async_browse_media(entry_id, event_dir, page)
 
+    async def _async_browse_media(self, entry_id:str, event_dir:str, page:int) -> BrowseMediaSource:
         if entry_id is None:
             media_class = MediaClass.DIRECTORY
             media = BrowseMediaSource(
@@ -104,11 +107,19 @@ class YiHackMediaSource(MediaSource):
 #                thumbnail=thumbnail,
             )
             media.children = []
+            media.children.append(
+                BrowseMediaSource(
+                    domain=DOMAIN,
+                    identifier=TIMELINE_ID,
+                    media_class=MediaClass.DIRECTORY,
+                    media_content_type=MediaType.VIDEO,
+                    title=TITLE_TIMELINE,
+                    can_play=False,
+                    can_expand=True,
+                )
+            )
             for config_entry in self.hass.config_entries.async_entries(DOMAIN):
-                title = config_entry.data[CONF_NAME]
-                for device in self._devices:
-                    if config_entry.data[CONF_NAME] == device.name:
-                        title = device.name_by_user if device.name_by_user is not None else device.name
+                title = self._get_title(config_entry)
 
                 media_class = MediaClass.APP
                 child_dev = BrowseMediaSource(
@@ -123,141 +134,178 @@ class YiHackMediaSource(MediaSource):
                 )
                 media.children.append(child_dev)
 
+        elif entry_id == TIMELINE_ID:
+            media = await self._async_browse_timeline(page)
+
         elif event_dir is None:
-            for config_entry in self.hass.config_entries.async_entries(DOMAIN):
-                if config_entry.data[CONF_NAME] == entry_id:
-                    host = config_entry.data[CONF_HOST]
-                    port = config_entry.data[CONF_PORT]
-                    user = config_entry.data[CONF_USERNAME]
-                    password = config_entry.data[CONF_PASSWORD]
-            if host == "":
+            recordings = get_recordings(self.hass, entry_id)
+            if recordings is None:
                 return None
 
-            media_class = MediaClass.DIRECTORY
-            media = BrowseMediaSource(
-                domain=DOMAIN,
-                identifier=entry_id,
-                media_class=media_class,
-                media_content_type=MediaType.VIDEO,
-                title=entry_id,
-                can_play=False,
-                can_expand=True,
-#                thumbnail=thumbnail,
-            )
-            try:
-                auth = None
-                if user or password:
-                    auth = HTTPBasicAuth(user, password)
-
-                eventsdir_url = "http://" + host + ":" + str(port) + "/cgi-bin/eventsdir.sh"
-                response = requests.post(eventsdir_url, timeout=HTTP_TIMEOUT, auth=auth)
-                if response.status_code >= 300:
-                    _LOGGER.error("Failed to send eventsdir command to device %s", host)
-                    error = True
-            except requests.exceptions.RequestException as error:
-                _LOGGER.error("Failed to send eventsdir command to device %s: error %s", host, error)
-                error = True
-
-            if response is None:
-                _LOGGER.error("Failed to send eventsdir command to device %s: error unknown", host)
-                error = True
-
-            if error:
+            result = await recordings.async_get_dirs(page * BROWSE_PAGE_SIZE, BROWSE_PAGE_SIZE)
+            if result is None:
                 return None
+            records_dir, total = result
 
-            records_dir = response.json()["records"]
-            if len(records_dir) > 0:
-                media.children = []
-                for record_dir in records_dir:
-                    dir_path = record_dir["dirname"].replace("/", "-")
-                    title = record_dir["datetime"].replace("Date: ", "").replace("Time: ", "")
-                    media_class = MediaClass.DIRECTORY
-
-                    child_dir = BrowseMediaSource(
-                        domain=DOMAIN,
-                        identifier=entry_id + "/" + dir_path,
-                        media_class=media_class,
-                        media_content_type=MediaType.VIDEO,
-                        title=title,
-                        can_play=False,
-                        can_expand=True,
-#                        thumbnail=thumbnail,
-                    )
-
-                    media.children.append(child_dir)
+            media = _page_media(entry_id, entry_id, page, total)
+            for dir_path, title in records_dir:
+                media_class = MediaClass.DIRECTORY
+
+                child_dir = BrowseMediaSource(
+                    domain=DOMAIN,
+                    identifier=entry_id + "/" + dir_path,
+                    media_class=media_class,
+                    media_content_type=MediaType.VIDEO,
+                    title=title,
+                    can_play=False,
+                    can_expand=True,
+#                    thumbnail=thumbnail,
+                )
+
+                media.children.append(child_dir)
+            _add_page_links(media, entry_id, page, total)
 
         else:
-            for config_entry in self.hass.config_entries.async_entries(DOMAIN):
-                if config_entry.data[CONF_NAME] == entry_id:
-                    host = config_entry.data[CONF_HOST]
-                    port = config_entry.data[CONF_PORT]
-                    user = config_entry.data[CONF_USERNAME]
-                    password = config_entry.data[CONF_PASSWORD]
-            if host == "":
+            recordings = get_recordings(self.hass, entry_id)
+            if recordings is None:
                 return None
 
-            title = event_dir
-            media_class = MediaClass.VIDEO
+            result = await recordings.async_get_files(event_dir, page * BROWSE_PAGE_SIZE, BROWSE_PAGE_SIZE)
+            if result is None:
+                return None
+            records_file, total = result
 
-            media = BrowseMediaSource(
+            media = _page_media(entry_id + "/" + event_dir, event_dir, page, total)
+            for file_path, thumb_path, title in records_file:
+                media_class = MediaClass.VIDEO
+
+                child_file = BrowseMediaSource(
+                    domain=DOMAIN,
+                    identifier=entry_id + "/" + event_dir + "/" + file_path,
+                    media_class=media_class,
+                    media_content_type=MediaType.VIDEO,
+                    title=title,
+                    can_play=True,
+                    can_expand=False,
+                )
+                if (thumb_path != ""):
+                    child_file.thumbnail="/api/yi-hack/" + entry_id + "/" + event_dir + "/" + thumb_path
+                media.children.append(child_file)
+            _add_page_links(media, entry_id + "/" + event_dir, page, total)
+
+        return media
+
+    def _get_title(self, config_entry) -> str:
+        """Return the name of the device of a config entry."""
+        title = config_entry.data[CONF_NAME]
+        for device in self._devices:
+            if config_entry.data[CONF_NAME] == device.name:
+                title = device.name_by_user if device.name_by_user is not None else device.name
+        return title
+
+    async def _async_browse_timeline(self, page: int) -> BrowseMediaSource:
+        """Return a page of the recordings of all the cams, newest first."""
+        # The page needs at most this many recordings from each cam, one more tells if there is a next page
+        needed = (page + 1) * BROWSE_PAGE_SIZE + 1
+
+        async def async_collect(entry_id: str) -> list[tuple[dt.datetime, str, str, Recording]]:
+            items = []
+            recordings = get_recordings(self.hass, entry_id)
+            if recordings is not None:
+                async for start, dir_path, recording in recordings.async_iter_recordings():
+                    items.append((start, entry_id, dir_path, recording))
+                    if len(items) == needed:
+                        break
+            return items
+
+        titles = {
+            config_entry.data[CONF_NAME]: self._get_title(config_entry)
+            for config_entry in self.hass.config_entries.async_entries(DOMAIN)
+        }
+        # Fetch the cams concurrently, skipping the ones too slow to answer
+        tasks = {entry_id: asyncio.create_task(async_collect(entry_id)) for entry_id in titles}
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=BROWSE_TIMELINE_TIMEOUT)
+            for task in pending:
+                task.cancel()
+        sources = []
+        for entry_id, task in tasks.items():
+            if task in pending:
+                _LOGGER.warning("Recordings of %s not listed in %ss, skipped", entry_id, BROWSE_TIMELINE_TIMEOUT)
+            elif (error := task.exception()) is not None:
+                _LOGGER.error("Failed to list the recordings of %s, skipped: %r", entry_id, error)
+            else:
+                sources.append(task.result())
+
+        merged = heapq.merge(*sources, key=itemgetter(0), reverse=True)
+        items = list(islice(merged, page * BROWSE_PAGE_SIZE, needed))
+
+        media = _page_media(TIMELINE_ID, TITLE_TIMELINE, page)
+        for start, entry_id, event_dir, (file_path, thumb_path, _) in items[:BROWSE_PAGE_SIZE]:
+            child_file = BrowseMediaSource(
                 domain=DOMAIN,
-                identifier=entry_id + "/" + event_dir,
-                media_class=media_class,
+                identifier=entry_id + "/" + event_dir + "/" + file_path,
+                media_class=MediaClass.VIDEO,
                 media_content_type=MediaType.VIDEO,
-                title=title,
-                can_play=False,
-                can_expand=True,
-#                thumbnail=thumbnail,
+                title=titles[entry_id] + " " + start.strftime(TIMELINE_TIME_FORMAT),
+                can_play=True,
+                can_expand=False,
             )
+            if (thumb_path != ""):
+                child_file.thumbnail="/api/yi-hack/" + entry_id + "/" + event_dir + "/" + thumb_path
+            media.children.append(child_file)
+        _add_page_links(media, TIMELINE_ID, page, page * BROWSE_PAGE_SIZE + len(items))
+        return media
 
-            try:
-                auth = None
-                if user or password:
-                    auth = HTTPBasicAuth(user, password)
-
-                eventsfile_url = "http://" + host + ":" + str(port) + "/cgi-bin/eventsfile.sh?dirname=" + event_dir.replace("-", "/")
-                response = requests.post(eventsfile_url, timeout=HTTP_TIMEOUT, auth=auth)
-                if response.status_code >= 300:
-                    _LOGGER.error("Failed to send eventsfile command to device %s", host)
-                    error = True
-            except requests.exceptions.RequestException as error:
-                _LOGGER.error("Failed to send eventsfile command to device %s: error %s", host, error)
-                error = True
-
-            if response is None:
-                _LOGGER.error("Failed to send eventsfile command to device %s: error unknown", host)
-                error = True
-
-            if error:
-                return None
 
-            records_file = response.json()["records"]
-            if len(records_file) > 0:
-                media.children = []
-                for record_file in records_file:
-                    file_path = record_file["filename"]
-                    try:
-                        thumb_path = record_file["thumbfilename"]
-                    except KeyError:
-                        thumb_path = ""
-
-                    title = record_file["time"]
-                    media_class = MediaClass.VIDEO
-
-                    child_file = BrowseMediaSource(
-                        domain=DOMAIN,
-                        identifier=entry_id + "/" + event_dir + "/" + file_path,
-                        media_class=media_class,
-                        media_content_type=MediaType.VIDEO,
-                        title=title,
-                        can_play=True,
-                        can_expand=False,
-                    )
-                    if (thumb_path != ""):
-                        child_file.thumbnail="/api/yi-hack/" + entry_id + "/" + event_dir + "/" + thumb_path
-                    media.children.append(child_file)
+def _parse_page(part: str) -> int:
+    """Return the page number of a page identifier."""
+    try:
+        return max(0, int(part[len(PAGE_PREFIX):]))
+    except ValueError:
+        raise BrowseError("Invalid page " + part) from None
 
-        return media
+
+def _page_media(identifier: str, title: str, page: int, total: int | None = None) -> BrowseMediaSource:
+    """Return a directory for a page of children."""
+    if page > 0:
+        identifier += "/" + PAGE_PREFIX + str(page)
+        if total is not None:
+            title += " (" + str(page + 1) + "/" + str(-(-total // BROWSE_PAGE_SIZE)) + ")"
+        else:
+            title += " (" + str(page + 1) + ")"
+
+    media = BrowseMediaSource(
+        domain=DOMAIN,
+        identifier=identifier,
+        media_class=MediaClass.DIRECTORY,
+        media_content_type=MediaType.VIDEO,
+        title=title,
+        can_play=False,
+        can_expand=True,
+    )
+    media.children = []
+    return media
+
+
+def _add_page_links(media: BrowseMediaSource, identifier: str, page: int, total: int) -> None:
+    """Add the links to the newer and older pages around the children of a page."""
+    def link(title: str, to_page: int) -> BrowseMediaSource:
+        return BrowseMediaSource(
+            domain=DOMAIN,
+            identifier=identifier + "/" + PAGE_PREFIX + str(to_page),
+            media_class=MediaClass.DIRECTORY,
+            media_content_type=MediaType.VIDEO,
+            title=title,
+            can_play=False,
+            can_expand=True,
+        )
+
+    if page > 0:
+        media.children.insert(0, link(TITLE_NEWER, page - 1))
+    if (page + 1) * BROWSE_PAGE_SIZE < total:
+        media.children.append(link(TITLE_OLDER, page + 1))
 
 
 @callback
@@ -0,0 +1,236 @@
+"""Shared MJPEG stream of a yi-hack cam."""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from collections.abc import Awaitable, Callable
+import logging
+import time
+from typing import Any
+
+from haffmpeg.camera import CameraMjpeg
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import (GRABBER_MAX_RECONNECT_DELAY, GRABBER_RECONNECT_DELAY,
+                    LATENCY_SAMPLES, MJPEG_BOUNDARY, MJPEG_CLIENT_BUFFER,
+                    MJPEG_GRACE_PERIOD, MJPEG_MAX_FRAME_SIZE)
+
+_LOGGER = logging.getLogger(__name__)
+
+READ_SIZE = 65536
+
+
+class MjpegHub:
+    """Run a single FFmpeg MJPEG transcoder for a cam and share its frames with all the viewers."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        name: str,
+        binary: str,
+        extra_arguments: str,
+        get_stream_source: Callable[[], Awaitable[str | None]],
+        on_failure: Callable[[], None],
+    ) -> None:
+        """Initialize the hub."""
+        self.hass = hass
+        self.name = name
+        self._binary = binary
+        self._extra_arguments = extra_arguments
+        self._get_stream_source = get_stream_source
+        self._on_failure = on_failure
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: asyncio.Task | None = None
+        self._cancel_stop: Callable[[], None] | None = None
+        self.starts = 0
+        self.frames = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        """Return True if the transcoder is running."""
+        return self._task is not None
+
+    def subscribe(self) -> asyncio.Queue:
+        """Return a queue receiving the frames, None when the stream ends."""
+        if self._cancel_stop is not None:
+            self._cancel_stop()
+            self._cancel_stop = None
+
+        queue = asyncio.Queue(maxsize=MJPEG_CLIENT_BUFFER)
+        self._subscribers.add(queue)
+        if self._task is None:
+            self.starts += 1
+            self._task = self.hass.async_create_background_task(
+                self._async_run(), "yi_hack mjpeg " + self.name
+            )
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """Stop sending frames to a queue, stop the transcoder if nobody is watching."""
+        self._subscribers.discard(queue)
+        if not self._subscribers and self._task is not None and self._cancel_stop is None:
+            self._cancel_stop = async_call_later(self.hass, MJPEG_GRACE_PERIOD, self._async_grace_expired)
+
+    @callback
+    def _async_grace_expired(self, _now) -> None:
+        """Stop the transcoder after the grace period."""
+        self._cancel_stop = None
+        if not self._subscribers:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop the transcoder."""
+        if self._cancel_stop is not None:
+            self._cancel_stop()
+            self._cancel_stop = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for queue in self._subscribers:
+            self._put(queue, None)
+
+    async def _async_run(self) -> None:
+        """Read the frames from FFmpeg and send them to the subscribers."""
+        stream = None
+        try:
+            stream_source = await self._get_stream_source()
+            if not stream_source:
+                return
+
+            stream = CameraMjpeg(self._binary)
+            if not await stream.open_camera(stream_source, extra_cmd=self._extra_arguments):
+                _LOGGER.error("Unable to open the stream of %s", self.name)
+                self._on_failure()
+                return
+
+            _LOGGER.debug("Started the mjpeg stream of %s", self.name)
+            reader = await stream.get_reader()
+            buffer = b""
+            while True:
+                chunk = await reader.read(READ_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+
+                # Every frame starts with the boundary of the multipart stream
+                while (end := buffer.find(MJPEG_BOUNDARY, 1)) != -1:
+                    self._publish(buffer[:end])
+                    buffer = buffer[end:]
+                if len(buffer) > MJPEG_MAX_FRAME_SIZE:
+                    _LOGGER.warning("Invalid mjpeg stream from %s, dropping %d bytes", self.name, len(buffer))
+                    buffer = b""
+        finally:
+            if stream is not None:
+                await stream.close()
+            if self._task is asyncio.current_task():
+                self._task = None
+                for queue in self._subscribers:
+                    self._put(queue, None)
+            _LOGGER.debug("Stopped the mjpeg stream of %s", self.name)
+
+    def _publish(self, frame: bytes) -> None:
+        """Send a frame to all the subscribers."""
+        self.frames += 1
+        for queue in self._subscribers:
+            self._put(queue, frame)
+
+    def _put(self, queue: asyncio.Queue, item: bytes | None) -> None:
+        """Put an item in a queue, dropping the oldest frame of slow viewers."""
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(item)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the state of the hub."""
+        return {
+            "running": self.running,
+            "viewers": len(self._subscribers),
+            "starts": self.starts,
+            "frames": self.frames,
+            "dropped_frames": self.dropped,
+        }
+
+
+class FrameGrabber:
+    """Keep the latest frame of the shared MJPEG stream of a cam."""
+
+    def __init__(self, hass: HomeAssistant, hub: MjpegHub) -> None:
+        """Initialize the grabber."""
+        self.hass = hass
+        self._hub = hub
+        self._task: asyncio.Task | None = None
+        self._timestamps: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.image: bytes | None = None
+        self.frames = 0
+        self.reconnects = 0
+
+    @property
+    def age(self) -> float | None:
+        """Return the age in seconds of the latest frame."""
+        if not self._timestamps:
+            return None
+        return time.monotonic() - self._timestamps[-1]
+
+    @property
+    def rate(self) -> float | None:
+        """Return the frames per second decoded recently."""
+        if len(self._timestamps) < 2:
+            return None
+        return (len(self._timestamps) - 1) / max(self._timestamps[-1] - self._timestamps[0], 0.001)
+
+    def start(self) -> None:
+        """Start watching the stream."""
+        if self._task is None:
+            self._task = self.hass.async_create_background_task(
+                self._async_run(), "yi_hack frame grabber " + self._hub.name
+            )
+
+    def stop(self) -> None:
+        """Stop watching the stream."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _async_run(self) -> None:
+        """Keep the latest frame, watching the stream again when it ends."""
+        delay = GRABBER_RECONNECT_DELAY
+        while True:
+            queue = self._hub.subscribe()
+            try:
+                while (frame := await queue.get()) is not None:
+                    image = _get_jpeg(frame)
+                    if image:
+                        self.image = image
+                        self.frames += 1
+                        self._timestamps.append(time.monotonic())
+                        delay = GRABBER_RECONNECT_DELAY
+            finally:
+                self._hub.unsubscribe(queue)
+
+            self.reconnects += 1
+            _LOGGER.debug("The stream of %s ended, watching it again in %ss", self._hub.name, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, GRABBER_MAX_RECONNECT_DELAY)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the state of the grabber."""
+        age = self.age
+        rate = self.rate
+        return {
+            "running": self._task is not None,
+            "frames": self.frames,
+            "reconnects": self.reconnects,
+            "frame_age": round(age, 3) if age is not None else None,
+            "frame_rate": round(rate, 2) if rate is not None else None,
+        }
+
+
+def _get_jpeg(frame: bytes) -> bytes | None:
+    """Return the image of a part of the multipart stream."""
+    headers_end = frame.find(b"\r\n\r\n")
+    if headers_end == -1:
+        return None
+    return frame[headers_end + 4:].rstrip(b"\r\n")
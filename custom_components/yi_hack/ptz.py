@@ -0,0 +1,185 @@
+"""PTZ commands of a yi-hack cam."""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+
+from .common import LatencyStats, YiHackApi
+from .const import (PRIORITY_INTERACTIVE, PTZ_CONTINUOUS_MAX_TIME,
+                    PTZ_CONTINUOUS_STEP, PTZ_MAX_TRAVEL_TIME)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class PtzCommand:
+    """A move or a preset jump waiting to be sent to the cam."""
+
+    movement: str | None = None
+    travel_time: float = 0
+    preset_id: int | None = None
+    queued: float = field(default_factory=time.monotonic)
+    futures: list[asyncio.Future] = field(default_factory=list)
+
+    @property
+    def path(self) -> str:
+        """Return the path of the request."""
+        if self.preset_id is not None:
+            return f"cgi-bin/preset.sh?action=go_preset&num={self.preset_id}"
+        return "cgi-bin/ptz.sh?dir=" + self.movement + "&time=" + str(round(self.travel_time, 2))
+
+    def resolve(self, result: bool | None) -> None:
+        """Report the result to the callers: True if sent, False if failed, None if dropped."""
+        for future in self.futures:
+            if not future.done():
+                future.set_result(result)
+
+
+class PtzQueue:
+    """Send the PTZ commands of a cam one at a time, in order.
+
+    Consecutive moves in the same direction are merged, a preset jump drops
+    the queued commands, and a continuous move repeats short moves until it
+    is stopped, or for PTZ_CONTINUOUS_MAX_TIME if the stop never comes.
+    """
+
+    def __init__(self, hass: HomeAssistant, api: YiHackApi, name: str) -> None:
+        """Initialize the queue."""
+        self.hass = hass
+        self.name = name
+        self._api = api
+        self._pending: deque[PtzCommand] = deque()
+        self._task: asyncio.Task | None = None
+        self._continuous: str | None = None
+        self._continuous_until = 0.0
+        self.latency = LatencyStats()
+        self.coalesced = 0
+        self.dropped = 0
+
+    async def async_move(self, movement: str, travel_time: float) -> bool | None:
+        """Move the cam, return True when the cam acknowledged the move."""
+        self._continuous = None
+        futures = []
+        last = self._pending[-1] if self._pending else None
+        if last is not None and last.movement == movement and last.travel_time < PTZ_MAX_TRAVEL_TIME:
+            merged = min(travel_time, PTZ_MAX_TRAVEL_TIME - last.travel_time)
+            last.travel_time += merged
+            travel_time -= merged
+            self.coalesced += 1
+            futures.append(self._get_future(last))
+
+        # What doesn't fit in the last command is queued as a new one
+        if not futures or round(travel_time, 2) > 0:
+            futures.append(self._get_future(self._enqueue(PtzCommand(movement=movement, travel_time=travel_time))))
+
+        results = await asyncio.gather(*futures)
+        if False in results:
+            return False
+        if None in results:
+            return None
+        return True
+
+    async def async_move_to_preset(self, preset_id: int) -> bool | None:
+        """Aim the cam at a preset, dropping the queued commands."""
+        self._continuous = None
+        self._drop_pending()
+        return await self._get_future(self._enqueue(PtzCommand(preset_id=preset_id)))
+
+    def start(self, movement: str) -> None:
+        """Move the cam until stop() is called, calling it again extends the move."""
+        if movement != self._continuous:
+            self._drop_pending()
+            self._continuous = movement
+        self._continuous_until = time.monotonic() + PTZ_CONTINUOUS_MAX_TIME
+        self._ensure_running()
+
+    def stop(self) -> None:
+        """Stop a continuous move."""
+        if self._continuous is not None:
+            self._continuous = None
+            self._drop_pending()
+
+    def close(self) -> None:
+        """Drop all the commands."""
+        self._continuous = None
+        self._drop_pending()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _enqueue(self, command: PtzCommand) -> PtzCommand:
+        """Queue a command and start sending."""
+        self._pending.append(command)
+        self._ensure_running()
+        return command
+
+    def _get_future(self, command: PtzCommand) -> asyncio.Future:
+        """Return a future set when the command is sent."""
+        future = self.hass.loop.create_future()
+        command.futures.append(future)
+        return future
+
+    def _drop_pending(self) -> None:
+        """Drop the queued commands."""
+        while self._pending:
+            self.dropped += 1
+            self._pending.popleft().resolve(None)
+
+    def _ensure_running(self) -> None:
+        """Start sending the commands if not already doing it."""
+        if self._task is None:
+            self._task = self.hass.async_create_background_task(
+                self._async_run(), "yi_hack ptz " + self.name
+            )
+
+    async def _async_run(self) -> None:
+        """Send the commands one at a time."""
+        try:
+            while True:
+                if self._pending:
+                    command = self._pending.popleft()
+                elif self._continuous is not None and time.monotonic() >= self._continuous_until:
+                    _LOGGER.warning("No ptz stop for %s after %ss, stopping the move", self.name, PTZ_CONTINUOUS_MAX_TIME)
+                    self._continuous = None
+                    break
+                elif self._continuous is not None:
+                    command = PtzCommand(movement=self._continuous, travel_time=PTZ_CONTINUOUS_STEP)
+                else:
+                    break
+
+                start = time.monotonic()
+                try:
+                    result = await self._api.async_request("GET", command.path, priority=PRIORITY_INTERACTIVE)
+                except asyncio.CancelledError:
+                    command.resolve(None)
+                    raise
+                self.latency.add(time.monotonic() - command.queued, result is not None)
+                command.resolve(result is not None)
+
+                if command.futures:
+                    continue
+                if result is None:
+                    _LOGGER.error("Failed to send ptz command to device %s, stopping the move", self._api.host)
+                    self._continuous = None
+                else:
+                    # Don't send the steps of a continuous move faster than the cam moves
+                    await asyncio.sleep(max(0, PTZ_CONTINUOUS_STEP - (time.monotonic() - start)))
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the queue metrics."""
+        return {
+            "pending": len(self._pending),
+            "continuous": self._continuous,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "latency": self.latency.as_dict(),
+        }
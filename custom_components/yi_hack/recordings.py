@@ -0,0 +1,391 @@
+"""Index of the recordings saved on the SD card of the yi-hack cams."""
+from __future__ import annotations
+
+import asyncio
+import bisect
+from collections.abc import AsyncIterator
+import datetime as dt
+from itertools import islice
+import logging
+from operator import itemgetter
+import time
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .common import YiHackApi
+from .const import (DATA_RECORDINGS, DOMAIN, PRIORITY_BULK,
+                    RECORDINGS_FULL_REFRESH_INTERVAL,
+                    RECORDINGS_REFRESH_INTERVAL, RECORDINGS_SAVE_DELAY,
+                    RECORDINGS_STORAGE_KEY, STORAGE_VERSION)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Name of the hour directories and of the recordings of the yi-hack firmwares
+DIR_FORMAT = "%YY%mM%dD%HH"
+FILE_FORMAT = "%MM%SS"
+DIR_TITLE_FORMAT = "%Y-%m-%d %H:%M"
+
+# A recording: file name, thumbnail file name ("" if missing), title
+Recording = tuple[str, str, str]
+
+
+class RecordingsIndex:
+    """Keep the hour directories and the recordings of a cam.
+
+    Listing the SD card is slow on a full card, so the index is saved on
+    disk and the browsing is served from it. Past hours don't change: only
+    the newest hour directory is fetched again, in background or when a
+    motion stops, and the whole card is listed once a day to forget the
+    recordings deleted by the cam.
+    """
+
+    def __init__(self, hass: HomeAssistant, api: YiHackApi, entry_id: str, name: str) -> None:
+        """Initialize the index."""
+        self.hass = hass
+        self.name = name
+        self._api = api
+        self._store = Store(hass, STORAGE_VERSION, RECORDINGS_STORAGE_KEY + "." + entry_id)
+        # Hour directory -> title, newest first
+        self._dirs: dict[str, str] = {}
+        # Hour directory -> recordings, for the directories already listed
+        self._files: dict[str, list[Recording]] = {}
+        # Sorted views of the index for the searches, built when needed
+        self._hours: list[tuple[dt.datetime, str]] | None = None
+        self._starts: dict[str, list[tuple[dt.datetime, Recording]]] = {}
+        self._listed = 0.0
+        self._refreshed = 0.0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._motion_task: asyncio.Task | None = None
+        self._motion_pending = False
+        self.hits = 0
+        self.misses = 0
+        self.motion_updates = 0
+        # Directories and recordings without a time in their name
+        self._unsearchable: set[str] = set()
+
+    async def async_load(self) -> None:
+        """Read the index saved on disk."""
+        async with self._lock:
+            if self._loaded:
+                return
+            data = await self._store.async_load()
+            if data is not None:
+                self._dirs = dict(data["dirs"])
+                self._files = {
+                    dir_path: [tuple(recording) for recording in recordings]
+                    for dir_path, recordings in data["files"].items()
+                }
+                self._listed = data["listed"]
+            self._loaded = True
+
+    async def async_get_dirs(
+        self, offset: int = 0, count: int | None = None
+    ) -> tuple[list[tuple[str, str]], int] | None:
+        """Return a page of the hour directories with their titles, newest first, and the number of directories."""
+        if not await self._async_ensure_listed():
+            return None
+
+        stop = None if count is None else offset + count
+        return list(islice(self._dirs.items(), offset, stop)), len(self._dirs)
+
+    async def _async_ensure_listed(self) -> bool:
+        """Load the index and list the hour directories if never done, False on error."""
+        await self.async_load()
+        if not self._listed:
+            self.misses += 1
+            return await self._async_list_dirs()
+
+        self.hits += 1
+        self._schedule_refresh()
+        return True
+
+    async def async_get_files(
+        self, dir_path: str, offset: int = 0, count: int | None = None
+    ) -> tuple[list[Recording], int] | None:
+        """Return a page of the recordings of an hour directory and the number of recordings."""
+        await self.async_load()
+        if dir_path not in self._files:
+            self.misses += 1
+            if not await self._async_list_files(dir_path):
+                return None
+        else:
+            self.hits += 1
+            if dir_path == self._newest_dir():
+                self._schedule_refresh()
+
+        files = self._files.get(dir_path, [])
+        stop = None if count is None else offset + count
+        return files[offset:stop], len(files)
+
+    async def async_iter_recordings(self) -> AsyncIterator[tuple[dt.datetime, str, Recording]]:
+        """Yield the recordings with their start time and hour directory, newest first.
+
+        The hour directories are listed only when the iteration reaches them.
+        """
+        result = await self.async_get_dirs()
+        if result is None:
+            return
+
+        for dir_path, _ in result[0]:
+            if await self.async_get_files(dir_path) is None:
+                continue
+            for started, recording in reversed(self._get_starts(dir_path)):
+                yield started, dir_path, recording
+
+    async def async_search(
+        self, start: dt.datetime, end: dt.datetime
+    ) -> list[tuple[dt.datetime, str, Recording]] | None:
+        """Return the recordings started between start and end (cam local times), oldest first.
+
+        The hour directories and the recordings are found with a binary search
+        on their start time, only the hour directories in the range are listed.
+        """
+        if not await self._async_ensure_listed():
+            return None
+
+        hours = self._get_hours()
+        # An hour directory holds the recordings started in its hour: skip the ones ended before start
+        first = bisect.bisect_right(hours, start - dt.timedelta(hours=1), key=itemgetter(0))
+        last = bisect.bisect_right(hours, end, key=itemgetter(0))
+
+        found = []
+        for _, dir_path in hours[first:last]:
+            if await self.async_get_files(dir_path) is None:
+                continue
+            starts = self._get_starts(dir_path)
+            low = bisect.bisect_left(starts, start, key=itemgetter(0))
+            high = bisect.bisect_right(starts, end, key=itemgetter(0))
+            found.extend((started, dir_path, recording) for started, recording in starts[low:high])
+        return found
+
+    def _get_hours(self) -> list[tuple[dt.datetime, str]]:
+        """Return the hour directories sorted by time."""
+        if self._hours is None:
+            hours = []
+            for dir_path in self._dirs:
+                try:
+                    hours.append((dt.datetime.strptime(dir_path, DIR_FORMAT), dir_path))
+                except ValueError:
+                    self._warn_unsearchable(dir_path)
+            self._hours = sorted(hours)
+        return self._hours
+
+    def _get_starts(self, dir_path: str) -> list[tuple[dt.datetime, Recording]]:
+        """Return the recordings of an hour directory sorted by start time."""
+        if dir_path not in self._starts:
+            starts = []
+            for recording in self._files.get(dir_path, []):
+                started = recording_time(dir_path, recording[0])
+                if started is not None:
+                    starts.append((started, recording))
+                else:
+                    self._warn_unsearchable(dir_path + "/" + recording[0])
+            self._starts[dir_path] = sorted(starts, key=itemgetter(0))
+        return self._starts[dir_path]
+
+    def _warn_unsearchable(self, path: str) -> None:
+        """Count a directory or recording without a time in its name, warning the first time."""
+        if not self._unsearchable:
+            _LOGGER.warning(
+                "The recordings of %s are not named as expected (e.g. %s): they can't be found by time",
+                self.name,
+                path,
+            )
+        # The sorted views are built again after each refresh, count each path once
+        self._unsearchable.add(path)
+
+    def close(self) -> None:
+        """Stop the background refresh."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._motion_task is not None:
+            self._motion_task.cancel()
+            self._motion_task = None
+
+    def _newest_dir(self) -> str | None:
+        """Return the newest hour directory."""
+        return next(iter(self._dirs), None)
+
+    def _current_dir(self) -> tuple[str, str] | None:
+        """Return the directory and the title of the current hour, if the cam names them as expected."""
+        newest = self._newest_dir()
+        if newest is None:
+            return None
+        try:
+            dt.datetime.strptime(newest, DIR_FORMAT)
+        except ValueError:
+            return None
+
+        hour = dt_util.now().replace(minute=0, second=0, microsecond=0)
+        return hour.strftime(DIR_FORMAT), hour.strftime(DIR_TITLE_FORMAT)
+
+    def _schedule_refresh(self) -> None:
+        """Refresh the newest recordings in background, at most once a minute."""
+        if self._task is not None or time.monotonic() - self._refreshed < RECORDINGS_REFRESH_INTERVAL:
+            return
+        self._refreshed = time.monotonic()
+        self._task = self.hass.async_create_background_task(
+            self._async_refresh(), "yi_hack recordings " + self.name
+        )
+
+    async def _async_refresh(self) -> None:
+        """Fetch the newest hour directory again, and the whole card once a day."""
+        try:
+            if time.time() - self._listed > RECORDINGS_FULL_REFRESH_INTERVAL:
+                await self._async_list_dirs()
+            await self._async_refresh_newest()
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    @callback
+    def async_motion_stopped(self) -> None:
+        """Fetch the newest hour directories, the cam just saved a recording."""
+        self._motion_pending = True
+        if self._motion_task is None:
+            self._motion_task = self.hass.async_create_background_task(
+                self._async_update_on_motion(), "yi_hack recordings motion " + self.name
+            )
+
+    async def _async_update_on_motion(self) -> None:
+        """Fetch the newest hour directories until no motion stopped during the fetch."""
+        try:
+            await self.async_load()
+            if not self._listed:
+                # Nothing to update, the first browse lists the whole card
+                return
+            while self._motion_pending:
+                self._motion_pending = False
+                self.motion_updates += 1
+                await self._async_refresh_newest()
+        finally:
+            if self._motion_task is asyncio.current_task():
+                self._motion_task = None
+
+    async def _async_refresh_newest(self) -> None:
+        """Fetch the directory of the current hour and the newest one already indexed."""
+        # The newest directory gets the recordings ending after the hour
+        # changed, and all of them when the cam clock is not in HA's timezone
+        previous = self._newest_dir()
+        current = await self._async_refresh_current()
+        if previous is not None and previous != current:
+            await self._async_list_files(previous)
+
+    async def _async_refresh_current(self) -> str | None:
+        """Fetch the directory of the current hour, adding it when it is new.
+
+        Return the directory fetched, the newest one if the cam doesn't name
+        the directories as expected.
+        """
+        current = self._current_dir()
+        if current is None:
+            newest = self._newest_dir()
+            if newest is not None:
+                await self._async_list_files(newest)
+            return newest
+
+        dir_path, title = current
+        if dir_path in self._dirs:
+            await self._async_list_files(dir_path)
+        elif await self._async_list_files(dir_path) and self._files.get(dir_path):
+            # The cam started a new hour directory since the last listing
+            self._dirs = {dir_path: title, **self._dirs}
+            self._hours = None
+            self._save()
+        else:
+            self._files.pop(dir_path, None)
+            self._starts.pop(dir_path, None)
+        return dir_path
+
+    async def _async_list_dirs(self) -> bool:
+        """List the hour directories of the cam."""
+        response = await self._api.async_get_json(
+            "cgi-bin/eventsdir.sh", method="POST", priority=PRIORITY_BULK, shared=True
+        )
+        if response is None:
+            _LOGGER.error("Failed to send eventsdir command to device %s", self._api.host)
+            return False
+
+        dirs = {}
+        for record_dir in response["records"]:
+            dir_path = record_dir["dirname"].replace("/", "-")
+            dirs[dir_path] = record_dir["datetime"].replace("Date: ", "").replace("Time: ", "")
+
+        self._dirs = dirs
+        self._hours = None
+        self._starts = {}
+        # Forget the recordings of the directories deleted by the cam
+        self._files = {dir_path: files for dir_path, files in self._files.items() if dir_path in dirs}
+        self._listed = time.time()
+        self._save()
+        return True
+
+    async def _async_list_files(self, dir_path: str) -> bool:
+        """List the recordings of an hour directory."""
+        response = await self._api.async_get_json(
+            "cgi-bin/eventsfile.sh?dirname=" + dir_path.replace("-", "/"),
+            method="POST", priority=PRIORITY_BULK, shared=True,
+        )
+        if response is None:
+            _LOGGER.error("Failed to send eventsfile command to device %s", self._api.host)
+            return False
+
+        files = [
+            (record_file["filename"], record_file.get("thumbfilename", ""), record_file["time"])
+            for record_file in response["records"]
+        ]
+        if self._files.get(dir_path) != files:
+            self._files[dir_path] = files
+            self._starts.pop(dir_path, None)
+            self._save()
+        return True
+
+    def _save(self) -> None:
+        """Save the index on disk, a few changes at a time."""
+        self._store.async_delay_save(self._data_to_save, RECORDINGS_SAVE_DELAY)
+
+    def _data_to_save(self) -> dict[str, Any]:
+        """Return the index to save."""
+        return {
+            "dirs": list(self._dirs.items()),
+            "files": self._files,
+            "listed": self._listed,
+        }
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the index metrics."""
+        return {
+            "dirs": len(self._dirs),
+            "listed_dirs": len(self._files),
+            "recordings": sum(len(files) for files in self._files.values()),
+            "listed": self._listed,
+            "refreshing": self._task is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "motion_updates": self.motion_updates,
+            "unsearchable": len(self._unsearchable),
+        }
+
+
+def recording_time(dir_path: str, file_path: str) -> dt.datetime | None:
+    """Return the start time of a recording, None if the cam doesn't name it as expected."""
+    try:
+        hour = dt.datetime.strptime(dir_path, DIR_FORMAT)
+        start = dt.datetime.strptime(file_path[:6], FILE_FORMAT)
+    except ValueError:
+        return None
+    return hour.replace(minute=start.minute, second=start.second)
+
+
+def get_recordings(hass: HomeAssistant, device_name: str) -> RecordingsIndex | None:
+    """Return the recordings index of a configured cam, None if it is not loaded."""
+    try:
+        return hass.data[DOMAIN][device_name][DATA_RECORDINGS]
+    except KeyError:
+        return None
@@ -0,0 +1,252 @@
+"""Services acting on many yi-hack cams at once."""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable
+import datetime as dt
+import heapq
+from itertools import islice
+import logging
+from operator import itemgetter
+import time
+from typing import Any
+
+import voluptuous as vol
+
+from homeassistant.components import websocket_api
+from homeassistant.components.camera import DOMAIN as CAMERA_DOMAIN
+from homeassistant.const import ATTR_ENTITY_ID
+from homeassistant.core import (HomeAssistant, ServiceCall, ServiceResponse,
+                                SupportsResponse)
+import homeassistant.helpers.config_validation as cv
+from homeassistant.util import dt as dt_util
+
+from .camera import (ATTR_LANGUAGE, ATTR_SENTENCE, DEFAULT_LANGUAGE, LANG_DE,
+                     LANG_ES, LANG_FR, LANG_GB, LANG_IT, LANG_US,
+                     YiHackCamera)
+from .const import (DEFAULT_BULK_PARALLELISM, DEFAULT_BULK_TIMEOUT,
+                    DEFAULT_SEARCH_LIMIT, DOMAIN, SERVICE_BULK_MOVE_TO_PRESET,
+                    SERVICE_BULK_REBOOT, SERVICE_BULK_SPEAK,
+                    SERVICE_SEARCH_RECORDINGS)
+
+_LOGGER = logging.getLogger(__name__)
+
+ATTR_PARALLELISM = "parallelism"
+ATTR_TIMEOUT = "timeout"
+ATTR_PRESET_ID = "preset_id"
+ATTR_START = "start"
+ATTR_END = "end"
+ATTR_LIMIT = "limit"
+
+WS_TYPE_SEARCH_RECORDINGS = DOMAIN + "/" + SERVICE_SEARCH_RECORDINGS
+
+BULK_SCHEMA = {
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_PARALLELISM, default=DEFAULT_BULK_PARALLELISM): vol.All(int, vol.Range(min=1, max=32)),
+    vol.Optional(ATTR_TIMEOUT, default=DEFAULT_BULK_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=1, max=3600)),
+}
+
+BULK_REBOOT_SCHEMA = vol.Schema(BULK_SCHEMA)
+
+BULK_MOVE_TO_PRESET_SCHEMA = vol.Schema({
+    **BULK_SCHEMA,
+    vol.Required(ATTR_PRESET_ID): vol.All(int, vol.Range(min=0, max=14)),
+})
+
+BULK_SPEAK_SCHEMA = vol.Schema({
+    **BULK_SCHEMA,
+    vol.Required(ATTR_LANGUAGE, default=DEFAULT_LANGUAGE): vol.In(
+        [LANG_DE, LANG_GB, LANG_US, LANG_ES, LANG_FR, LANG_IT]
+    ),
+    vol.Required(ATTR_SENTENCE): str,
+})
+
+SEARCH_SCHEMA = {
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Required(ATTR_START): cv.datetime,
+    vol.Required(ATTR_END): cv.datetime,
+    vol.Optional(ATTR_LIMIT, default=DEFAULT_SEARCH_LIMIT): vol.All(int, vol.Range(min=1, max=10000)),
+}
+
+SEARCH_RECORDINGS_SCHEMA = vol.Schema(SEARCH_SCHEMA)
+
+
+class BulkError(Exception):
+    """An action failed on a cam."""
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the bulk and search services, once for all the cams."""
+    if hass.services.has_service(DOMAIN, SERVICE_BULK_REBOOT):
+        return
+
+    async def async_bulk_reboot(call: ServiceCall) -> ServiceResponse:
+        """Reboot the cams and wait for them to come back online."""
+        async def reboot(camera: YiHackCamera) -> None:
+            if not await camera.async_reboot():
+                raise BulkError("reboot command failed")
+
+        async def wait_online(camera: YiHackCamera) -> None:
+            await camera.async_wait_online()
+
+        return await _async_run_bulk(hass, call, reboot, wait_online)
+
+    async def async_bulk_move_to_preset(call: ServiceCall) -> ServiceResponse:
+        """Aim the cams at a preset."""
+        async def move_to_preset(camera: YiHackCamera) -> None:
+            if not await camera.async_move_to_preset(call.data[ATTR_PRESET_ID]):
+                raise BulkError("go to preset command failed")
+
+        return await _async_run_bulk(hass, call, move_to_preset)
+
+    async def async_bulk_speak(call: ServiceCall) -> ServiceResponse:
+        """Make the cams speak a sentence."""
+        async def speak(camera: YiHackCamera) -> None:
+            if not await camera.async_speak(call.data[ATTR_LANGUAGE], call.data[ATTR_SENTENCE]):
+                raise BulkError("speak command failed")
+
+        return await _async_run_bulk(hass, call, speak)
+
+    async def async_search_recordings(call: ServiceCall) -> ServiceResponse:
+        """Find the recordings of the cams started in a time range."""
+        return await _async_search_recordings(hass, call.data)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_BULK_REBOOT, async_bulk_reboot,
+        schema=BULK_REBOOT_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_BULK_MOVE_TO_PRESET, async_bulk_move_to_preset,
+        schema=BULK_MOVE_TO_PRESET_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_BULK_SPEAK, async_bulk_speak,
+        schema=BULK_SPEAK_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_SEARCH_RECORDINGS, async_search_recordings,
+        schema=SEARCH_RECORDINGS_SCHEMA, supports_response=SupportsResponse.ONLY,
+    )
+    websocket_api.async_register_command(hass, websocket_search_recordings)
+
+
+def async_unload_services(hass: HomeAssistant) -> None:
+    """Remove the bulk and search services."""
+    for service in (SERVICE_BULK_REBOOT, SERVICE_BULK_MOVE_TO_PRESET, SERVICE_BULK_SPEAK,
+                    SERVICE_SEARCH_RECORDINGS):
+        hass.services.async_remove(DOMAIN, service)
+
+
+async def _async_run_bulk(
+    hass: HomeAssistant,
+    call: ServiceCall,
+    action: Callable[[YiHackCamera], Awaitable[None]],
+    wait: Callable[[YiHackCamera], Awaitable[None]] | None = None,
+) -> dict[str, Any]:
+    """Run an action on the cams, a few at a time, before a deadline.
+
+    The optional wait, e.g. for a cam to come back online, runs after the
+    action without taking one of the parallel slots.
+    """
+    component = hass.data.get(CAMERA_DOMAIN)
+    semaphore = asyncio.Semaphore(call.data[ATTR_PARALLELISM])
+    deadline = asyncio.get_running_loop().time() + call.data[ATTR_TIMEOUT]
+
+    async def run(entity_id: str) -> dict[str, Any]:
+        camera = component.get_entity(entity_id) if component is not None else None
+        if not isinstance(camera, YiHackCamera):
+            return {"success": False, "duration": 0, "error": "not a yi-hack camera"}
+
+        start = time.monotonic()
+        error = None
+        try:
+            async with asyncio.timeout_at(deadline):
+                async with semaphore:
+                    await action(camera)
+                if wait is not None:
+                    await wait(camera)
+        except TimeoutError:
+            error = "timeout"
+        except BulkError as err:
+            error = str(err)
+        except Exception as err:  # pylint: disable=broad-except
+            # One broken cam must not abort the whole bulk call
+            _LOGGER.exception("Unexpected error running %s on %s", call.service, entity_id)
+            error = str(err) or type(err).__name__
+
+        if error is not None:
+            _LOGGER.warning("Failed %s on %s: %s", call.service, entity_id, error)
+        return {
+            "success": error is None,
+            "duration": round(time.monotonic() - start, 3),
+            "error": error,
+        }
+
+    entity_ids = list(dict.fromkeys(call.data[ATTR_ENTITY_ID]))
+    results = await asyncio.gather(*(run(entity_id) for entity_id in entity_ids))
+    return {"results": dict(zip(entity_ids, results))}
+
+
+@websocket_api.websocket_command({
+    vol.Required("type"): WS_TYPE_SEARCH_RECORDINGS,
+    **SEARCH_SCHEMA,
+})
+@websocket_api.async_response
+async def websocket_search_recordings(
+    hass: HomeAssistant, connection: websocket_api.ActiveConnection, msg: dict[str, Any]
+) -> None:
+    """Find the recordings of the cams started in a time range."""
+    connection.send_result(msg["id"], await _async_search_recordings(hass, msg))
+
+
+async def _async_search_recordings(hass: HomeAssistant, data: dict[str, Any]) -> dict[str, Any]:
+    """Return the recordings of the cams started in a time range, oldest first."""
+    component = hass.data.get(CAMERA_DOMAIN)
+    cameras = {}
+    skipped = {}
+    if ATTR_ENTITY_ID in data:
+        for entity_id in data[ATTR_ENTITY_ID]:
+            camera = component.get_entity(entity_id) if component is not None else None
+            if isinstance(camera, YiHackCamera):
+                cameras[entity_id] = camera
+            else:
+                skipped[entity_id] = "not a yi-hack camera"
+    elif component is not None:
+        cameras = {camera.entity_id: camera for camera in component.entities if isinstance(camera, YiHackCamera)}
+
+    # The recordings are named after the local time of the cams
+    start = _to_local(data[ATTR_START])
+    end = _to_local(data[ATTR_END])
+    results = await asyncio.gather(
+        *(camera.async_search_recordings(start, end) for camera in cameras.values())
+    )
+
+    sources = []
+    entity_ids = {}
+    for entity_id, found in zip(cameras, results):
+        if found is None:
+            skipped[entity_id] = "recordings not available"
+        elif found:
+            sources.append(found)
+            entity_ids[found[0][1]] = entity_id
+
+    recordings = []
+    merged = heapq.merge(*sources, key=itemgetter(0))
+    for started, device_name, dir_path, (file_path, thumb_path, _) in islice(merged, data[ATTR_LIMIT]):
+        identifier = device_name + "/" + dir_path + "/" + file_path
+        recordings.append({
+            "entity_id": entity_ids[device_name],
+            "start": started.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE).isoformat(),
+            "media_content_id": "media-source://" + DOMAIN + "/" + identifier,
+            "url": "/api/yi-hack/" + identifier,
+            "thumbnail": "/api/yi-hack/" + device_name + "/" + dir_path + "/" + thumb_path if thumb_path else None,
+        })
+
+    return {"recordings": recordings, "skipped": skipped}
+
+
+def _to_local(value: dt.datetime) -> dt.datetime:
+    """Return a time as a naive local time."""
+    if value.tzinfo is not None:
+        value = dt_util.as_local(value).replace(tzinfo=None)
+    return value
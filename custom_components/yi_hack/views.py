@@ -8,24 +8,23 @@ import logging
 from typing import Any
 
 import aiohttp
-from aiohttp import hdrs, web, BasicAuth
+from aiohttp import hdrs, web
 from aiohttp.web_exceptions import HTTPBadGateway, HTTPUnauthorized
 from multidict import CIMultiDict
 
-from homeassistant.const import (
-    CONF_HOST,
-    CONF_NAME,
-    CONF_PASSWORD,
-    CONF_PORT,
-    CONF_USERNAME,
-)
+from homeassistant.const import CONF_NAME
+from homeassistant.components.camera import DOMAIN as CAMERA_DOMAIN
 from homeassistant.components.http import HomeAssistantView
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
 
+from .common import get_api, get_motion_images
 from .const import (
     CONF_HACK_NAME,
     DOMAIN,
+    PRIORITY_BULK,
+    PRIORITY_NORMAL,
     SONOFF,
 )
 
@@ -39,10 +38,9 @@ class VideoProxyView(HomeAssistantView):
     url = "/api/yi-hack/{entry_id}/{dir_path}/{file_path}"
     name = "api:yi-hack:video"
 
-    def __init__(self, hass: HomeAssistant, websession: aiohttp.ClientSession) -> None:
+    def __init__(self, hass: HomeAssistant) -> None:
         """Initialize NestEventViewBase."""
         self.hass = hass
-        self._websession = websession
 
     def _create_path(self, **kwargs: Any) -> str:
         """Create path."""
@@ -69,7 +67,7 @@ class VideoProxyView(HomeAssistantView):
         try:
             return await self._handle_request(request, **kwargs)
 
-        except aiohttp.ClientError as err:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
             _LOGGER.debug("Reverse proxy error for %s: %s", request.rel_url, err)
 
         raise HTTPBadGateway() from None
@@ -81,37 +79,31 @@ class VideoProxyView(HomeAssistantView):
     ) -> web.Response | web.StreamResponse:
         """Handle route for request."""
 
-        host = ""
-        for config_entry in self.hass.config_entries.async_entries(DOMAIN):
-            if config_entry.data[CONF_NAME] == kwargs['entry_id']:
-                host = config_entry.data[CONF_HOST]
-                port = config_entry.data[CONF_PORT]
-                user = config_entry.data[CONF_USERNAME]
-                password = config_entry.data[CONF_PASSWORD]
-
-        if host == "":
+        api = get_api(self.hass, kwargs['entry_id'])
+        if api is None:
             return web.Response(status=HTTPStatus.BAD_REQUEST)
 
         full_path = self._create_path(**kwargs)
         if not full_path:
             return web.Response(status=HTTPStatus.NOT_FOUND)
 
-        url = "http://" + host + ":" + str(port) + "/" + full_path
         data = await request.read()
         source_header = _init_header(request)
 
-        auth = None
-        if user or password:
-            auth = BasicAuth(user, password)
+        # Thumbnails are small, don't queue them behind the recordings
+        priority = PRIORITY_BULK
+        if not kwargs['file_path'].endswith(".mp4"):
+            priority = PRIORITY_NORMAL
 
-        async with self._websession.request(
+        async with api.async_open(
             request.method,
-            url,
+            full_path,
+            timeout=None,
+            priority=priority,
             headers=source_header,
             params=request.query,
             allow_redirects=False,
             data=data,
-            auth=auth,
         ) as result:
             headers = _response_header(result)
 
@@ -133,6 +125,122 @@ class VideoProxyView(HomeAssistantView):
             return response
 
 
+class MotionImageView(HomeAssistantView):
+    """View to list and get the latest motion images of a cam."""
+
+    requires_auth = True
+    url = "/api/yi-hack-motion/{entry_id}"
+    extra_urls = ["/api/yi-hack-motion/{entry_id}/{image_id}"]
+    name = "api:yi-hack:motion"
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the view."""
+        self.hass = hass
+
+    async def get(
+        self,
+        request: web.Request,
+        entry_id: str,
+        image_id: str | None = None,
+    ) -> web.Response:
+        """Return the list of the images, or an image.
+
+        image_id is the id of an image or "latest". The ago query parameter
+        selects the latest image taken at least that many seconds ago.
+        """
+        motion_images = get_motion_images(self.hass, entry_id)
+        if motion_images is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+
+        if image_id is None:
+            return self.json([
+                {
+                    "id": image.id,
+                    "timestamp": dt_util.utc_from_timestamp(image.timestamp).isoformat(),
+                    "size": len(image.content),
+                    "url": f"/api/yi-hack-motion/{entry_id}/{image.id}",
+                }
+                for image in reversed(list(motion_images))
+            ])
+
+        try:
+            if image_id == "latest":
+                before = None
+                if "ago" in request.query:
+                    before = dt_util.utcnow().timestamp() - float(request.query["ago"])
+                image = motion_images.latest(before)
+            else:
+                image = motion_images.get(int(image_id))
+        except ValueError:
+            return web.Response(status=HTTPStatus.BAD_REQUEST)
+
+        if image is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+
+        return _image_response(request, image.content, image.etag)
+
+
+class CameraImageView(HomeAssistantView):
+    """View to get the image of a yi-hack camera, with ETag support."""
+
+    requires_auth = True
+    url = "/api/yi-hack-image/{entity_id}"
+    name = "api:yi-hack:image"
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize the view."""
+        self.hass = hass
+
+    async def get(self, request: web.Request, entity_id: str) -> web.Response:
+        """Return the image of a camera, or 304 if the client already has it."""
+        component = self.hass.data.get(CAMERA_DOMAIN)
+        camera = component.get_entity(entity_id) if component is not None else None
+        if camera is None or not hasattr(camera, "async_camera_image_etag"):
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+
+        try:
+            width = int(request.query["width"]) if "width" in request.query else None
+            height = int(request.query["height"]) if "height" in request.query else None
+            max_age = float(request.query["max_age"]) if "max_age" in request.query else None
+        except ValueError:
+            return web.Response(status=HTTPStatus.BAD_REQUEST)
+        if max_age is not None and not max_age >= 0:
+            return web.Response(status=HTTPStatus.BAD_REQUEST)
+
+        result = await camera.async_camera_image_etag(width, height, max_age)
+        if result is None:
+            return web.Response(status=HTTPStatus.SERVICE_UNAVAILABLE)
+
+        return _image_response(request, *result)
+
+
+def _image_response(request: web.Request, content: bytes, etag: str) -> web.Response:
+    """Return an image, or 304 if the client already has it."""
+    headers = {
+        hdrs.ETAG: etag,
+        hdrs.CACHE_CONTROL: "private, no-cache",
+    }
+    if _etag_matches(etag, request.headers.get(hdrs.IF_NONE_MATCH)):
+        return web.Response(status=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+    return web.Response(body=content, content_type="image/jpeg", headers=headers)
+
+
+def _etag_matches(etag: str, if_none_match: str | None) -> bool:
+    """Return True if an If-None-Match header lists the ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    for token in if_none_match.split(","):
+        token = token.strip()
+        if token == "*":
+            return True
+        if token.startswith("W/"):
+            token = token[2:]
+        if token == etag:
+            return True
+    return False
+
+
 def _init_header(request: web.Request) -> CIMultiDict | dict[str, str]:
     """Create initial header."""
     headers = {}
@@ -0,0 +1,446 @@
+"""Benchmarks of the integration against fake yi-hack cams.
+
+The benchmarks drive a running Home Assistant instance through its REST and
+websocket APIs, with the integration installed and the cams simulated by
+tools/fake_cam.py (started in process with --start-fake). The results are
+written as json, to compare releases.
+
+Example:
+    python tools/benchmark.py --ha-url http://127.0.0.1:8123 --token $HA_TOKEN \
+        --start-fake --count 20 --dirs 500 --files 60 --output bench.json
+
+Benchmarks:
+    setup     config entry setup time per cam and for all the cams, cold
+              (from the cam) and warm (reload, from the configuration cache)
+    snapshot  camera proxy requests per second and latency percentiles
+    proxy     recording download throughput and time to first byte
+    browse    media browser latency for the cam and hour directory levels
+    loop      event loop lag (websocket ping round trip) under mqtt load
+
+The options of tools/fake_cam.py are accepted too.
+Requires aiohttp, and paho-mqtt for the loop benchmark.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_cam  # noqa: E402
+
+_LOGGER = logging.getLogger("benchmark")
+
+DOMAIN = "yi_hack"
+MANIFEST = os.path.join(os.path.dirname(__file__), "..", "custom_components", DOMAIN, "manifest.json")
+BENCHMARKS = ["setup", "snapshot", "proxy", "browse", "loop"]
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """Return the summary of a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+class HomeAssistantClient:
+    """Minimal REST and websocket client of Home Assistant."""
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, token: str) -> None:
+        """Initialize the client."""
+        self._session = session
+        self._url = url.rstrip("/")
+        self.headers = {"Authorization": "Bearer " + token}
+        self._token = token
+        self._ws = None
+        self._id = 0
+
+    def url(self, path: str) -> str:
+        """Return the full url of an api path."""
+        return self._url + path
+
+    async def async_rest(self, method: str, path: str, payload=None):
+        """Call the REST api and return the json response."""
+        async with self._session.request(method, self.url(path), json=payload, headers=self.headers) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def async_connect(self) -> None:
+        """Open and authenticate the websocket."""
+        self._ws = await self._session.ws_connect(self.url("/api/websocket"))
+        await self._ws.receive_json()
+        await self._ws.send_json({"type": "auth", "access_token": self._token})
+        message = await self._ws.receive_json()
+        if message["type"] != "auth_ok":
+            raise RuntimeError("Websocket authentication failed")
+
+    async def async_ws(self, message: dict):
+        """Send a websocket command and return its result."""
+        self._id += 1
+        await self._ws.send_json({"id": self._id, **message})
+        while True:
+            response = await self._ws.receive_json()
+            if response.get("id") == self._id:
+                break
+        if not response.get("success", True):
+            raise RuntimeError(response.get("error"))
+        return response.get("result")
+
+    async def async_close(self) -> None:
+        """Close the websocket."""
+        if self._ws is not None:
+            await self._ws.close()
+
+
+async def async_check_loaded(ha: HomeAssistantClient, entry_ids: set[str], timeout: float) -> None:
+    """Wait for the entries to be loaded, fail if some are not."""
+    start = time.monotonic()
+    while True:
+        entries = await ha.async_rest("GET", "/api/config/config_entries/entry?domain=" + DOMAIN)
+        loaded = {entry["entry_id"] for entry in entries if entry["state"] == "loaded"} & entry_ids
+        if len(loaded) == len(entry_ids) or time.monotonic() - start >= timeout:
+            break
+        await asyncio.sleep(0.05)
+
+    if len(loaded) < len(entry_ids):
+        raise RuntimeError(str(len(entry_ids) - len(loaded)) + " entries not loaded after " + str(timeout) + "s")
+
+
+async def async_diagnostics_timings(ha: HomeAssistantClient, entry_ids) -> list[dict]:
+    """Return the setup timings reported by the diagnostics of the entries."""
+    timings = []
+    for entry_id in entry_ids:
+        diagnostics = await ha.async_rest("GET", "/api/diagnostics/config_entry/" + entry_id)
+        timings.append(diagnostics["data"]["setup_timings"])
+    return timings
+
+
+def summarize_timings(timings: list[dict]) -> dict[str, dict]:
+    """Return the percentiles of every setup phase."""
+    phases = sorted({phase for timing in timings for phase in timing})
+    return {phase: percentiles([timing[phase] for timing in timings if phase in timing]) for phase in phases}
+
+
+async def async_bench_setup(ha: HomeAssistantClient, args) -> tuple[dict, list[str]]:
+    """Add one config entry for every cam and measure the setup."""
+
+    # Creating and reloading an entry return once its setup is done: time each call
+    async def add_entry(port):
+        start = time.monotonic()
+        flow = await ha.async_rest("POST", "/api/config/config_entries/flow", {"handler": DOMAIN})
+        result = await ha.async_rest("POST", "/api/config/config_entries/flow/" + flow["flow_id"], {
+            "host": args.cam_host,
+            "port": port,
+            "username": "",
+            "password": "",
+            "extra_arguments": "-rtsp_transport tcp",
+            "boost_speaker": "auto",
+        })
+        if result.get("type") != "create_entry":
+            raise RuntimeError("Config flow failed for port " + str(port) + ": " + str(result))
+        return result["result"]["entry_id"], time.monotonic() - start
+
+    async def reload_entry(entry_id):
+        start = time.monotonic()
+        await ha.async_rest("POST", "/api/config/config_entries/entry/" + entry_id + "/reload")
+        return time.monotonic() - start
+
+    ports = [args.base_port + index for index in range(args.count)]
+    start = time.monotonic()
+    added = await asyncio.gather(*(add_entry(port) for port in ports))
+    entry_ids = [entry_id for entry_id, _ in added]
+    cold = [duration for _, duration in added]
+    cold_total = time.monotonic() - start
+    await async_check_loaded(ha, set(entry_ids), args.timeout)
+    cold_timings = await async_diagnostics_timings(ha, entry_ids)
+
+    start = time.monotonic()
+    warm = await asyncio.gather(*(reload_entry(entry_id) for entry_id in entry_ids))
+    warm_total = time.monotonic() - start
+    await async_check_loaded(ha, set(entry_ids), args.timeout)
+    warm_timings = await async_diagnostics_timings(ha, entry_ids)
+
+    return {
+        "cams": len(entry_ids),
+        "cold": {
+            "total": round(cold_total, 4),
+            "per_cam": percentiles(cold),
+            "phases": summarize_timings(cold_timings),
+        },
+        "warm": {
+            "total": round(warm_total, 4),
+            "per_cam": percentiles(warm),
+            "phases": summarize_timings(warm_timings),
+        },
+    }, list(entry_ids)
+
+
+async def async_find_cams(ha: HomeAssistantClient) -> list[tuple[str, str]]:
+    """Return entity id and device name of the yi-hack cams."""
+    entities = await ha.async_ws({"type": "config/entity_registry/list"})
+    return [
+        (entity["entity_id"], entity["unique_id"][: -len("_caca")])
+        for entity in entities
+        if entity["platform"] == DOMAIN and entity["unique_id"].endswith("_caca")
+    ]
+
+
+async def async_load(args, worker) -> tuple[list[float], int, float]:
+    """Run worker with args.concurrency parallel clients for args.duration."""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + args.duration
+
+    async def client(index):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            try:
+                await worker(index)
+                latencies.append(time.monotonic() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                errors += 1
+
+    start = time.monotonic()
+    await asyncio.gather(*(client(index) for index in range(args.concurrency)))
+    return latencies, errors, time.monotonic() - start
+
+
+async def async_bench_snapshot(session, ha: HomeAssistantClient, cams, args) -> dict:
+    """Measure the camera proxy snapshots."""
+
+    async def worker(index):
+        entity_id = cams[index % len(cams)][0]
+        async with session.get(ha.url("/api/camera_proxy/" + entity_id), headers=ha.headers) as response:
+            response.raise_for_status()
+            await response.read()
+
+    latencies, errors, elapsed = await async_load(args, worker)
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "errors": errors,
+        "latency": percentiles(latencies),
+    }
+
+
+async def async_browse(ha: HomeAssistantClient, media_content_id: str):
+    """Browse a media source item."""
+    return await ha.async_ws({"type": "media_source/browse_media", "media_content_id": media_content_id})
+
+
+async def async_bench_browse(ha: HomeAssistantClient, cams, args) -> tuple[dict, list[str]]:
+    """Measure the media browser and return some recordings."""
+    cam_latencies = []
+    dir_latencies = []
+    recordings = []
+    for _ in range(args.repeat):
+        for _, name in cams:
+            start = time.monotonic()
+            cam = await async_browse(ha, "media-source://" + DOMAIN + "/" + name)
+            cam_latencies.append(time.monotonic() - start)
+            if not cam or not cam.get("children"):
+                continue
+
+            start = time.monotonic()
+            folder = await async_browse(ha, cam["children"][0]["media_content_id"])
+            dir_latencies.append(time.monotonic() - start)
+            for child in (folder or {}).get("children") or []:
+                if child["can_play"]:
+                    recordings.append(child["media_content_id"])
+
+    return {
+        "cam_level": percentiles(cam_latencies),
+        "dir_level": percentiles(dir_latencies),
+    }, recordings
+
+
+async def async_bench_proxy(session, ha: HomeAssistantClient, recordings, args) -> dict:
+    """Measure the recording downloads through the proxy view."""
+    urls = []
+    for media_content_id in recordings[: args.concurrency * 4]:
+        resolved = await ha.async_ws({"type": "media_source/resolve_media", "media_content_id": media_content_id})
+        urls.append(resolved["url"])
+    if not urls:
+        return {"error": "no recordings found"}
+
+    first_byte = []
+    transferred = 0
+
+    async def worker(index):
+        nonlocal transferred
+        start = time.monotonic()
+        url = urls[index % len(urls)]
+        if url.startswith("/"):
+            url = ha.url(url)
+        async with session.get(url, headers=ha.headers) as response:
+            response.raise_for_status()
+            first = True
+            async for chunk in response.content.iter_chunked(65536):
+                if first:
+                    first_byte.append(time.monotonic() - start)
+                    first = False
+                transferred += len(chunk)
+
+    latencies, errors, elapsed = await async_load(args, worker)
+    return {
+        "downloads": len(latencies),
+        "errors": errors,
+        "megabytes_per_second": round(transferred / elapsed / 1e6, 3),
+        "time_to_first_byte": percentiles(first_byte),
+        "download_time": percentiles(latencies),
+    }
+
+
+async def async_ping_lag(ha: HomeAssistantClient, duration: float) -> list[float]:
+    """Sample the websocket ping round trip for duration seconds."""
+    samples = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        await ha.async_ws({"type": "ping"})
+        samples.append(time.monotonic() - start)
+        await asyncio.sleep(0.05)
+    return samples
+
+
+async def async_bench_loop(ha: HomeAssistantClient, cams_sim, args) -> dict:
+    """Measure the event loop lag, idle and under mqtt load."""
+    idle = await async_ping_lag(ha, args.duration)
+
+    if not args.mqtt_host or not cams_sim:
+        return {"idle": percentiles(idle), "error": "--mqtt-host and --start-fake are required for the load phase"}
+
+    args.motion_interval = 1 / args.mqtt_rate * len(cams_sim)
+    publisher = fake_cam.MqttPublisher(args, cams_sim)
+    task = asyncio.create_task(publisher.async_run())
+    try:
+        loaded = await async_ping_lag(ha, args.duration)
+    finally:
+        task.cancel()
+        publisher.stop(send_will=False)
+
+    return {
+        "idle": percentiles(idle),
+        "mqtt_load": percentiles(loaded),
+        "mqtt_messages": publisher.published,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse the command line, fake_cam options included."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ha-url", default="http://127.0.0.1:8123")
+    parser.add_argument("--token", default=os.environ.get("HA_TOKEN"), help="long-lived access token")
+    parser.add_argument("--cam-host", default="127.0.0.1", help="host of the cams, as seen by Home Assistant")
+    parser.add_argument("--start-fake", action="store_true", help="run the fake cams in this process")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of every load phase")
+    parser.add_argument("--concurrency", type=int, default=10, help="parallel clients")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of the browse benchmark")
+    parser.add_argument("--mqtt-rate", type=float, default=200.0, help="motion events per second in the loop benchmark")
+    parser.add_argument("--timeout", type=float, default=120.0, help="max seconds to wait for setup")
+    parser.add_argument("--keep", action="store_true", help="keep the config entries created by the setup benchmark")
+    parser.add_argument("--output", help="json file for the results, stdout if missing")
+    args, remaining = parser.parse_known_args(argv)
+    fake_args = fake_cam.parse_args(remaining)
+    for key, value in vars(fake_args).items():
+        setattr(args, key, value)
+    return args
+
+
+async def async_main(args) -> dict:
+    """Run the benchmarks."""
+    with open(MANIFEST, encoding="utf-8") as manifest:
+        version = json.load(manifest)["version"]
+
+    results = {
+        "version": version,
+        "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "parameters": {
+            key: getattr(args, key)
+            for key in ("count", "dirs", "files", "latency", "jitter", "failure_rate",
+                        "snapshot_size", "record_size", "duration", "concurrency", "mqtt_rate")
+        },
+        "results": {},
+    }
+
+    runners = []
+    cams_sim = []
+    if args.start_fake:
+        cams_sim, runners = await fake_cam.async_start(args)
+
+    entry_ids = []
+    async with aiohttp.ClientSession() as session:
+        ha = HomeAssistantClient(session, args.ha_url, args.token)
+        await ha.async_connect()
+        try:
+            if "setup" in args.only:
+                _LOGGER.info("Setup benchmark")
+                results["results"]["setup"], entry_ids = await async_bench_setup(ha, args)
+
+            cams = await async_find_cams(ha)
+            if not cams:
+                raise RuntimeError("No yi-hack cams configured in Home Assistant")
+            recordings = []
+            if "snapshot" in args.only:
+                _LOGGER.info("Snapshot benchmark")
+                results["results"]["snapshot"] = await async_bench_snapshot(session, ha, cams, args)
+            if "browse" in args.only or "proxy" in args.only:
+                _LOGGER.info("Browse benchmark")
+                results["results"]["browse"], recordings = await async_bench_browse(ha, cams, args)
+            if "proxy" in args.only:
+                _LOGGER.info("Proxy benchmark")
+                results["results"]["proxy"] = await async_bench_proxy(session, ha, recordings, args)
+            if "loop" in args.only:
+                _LOGGER.info("Event loop benchmark")
+                results["results"]["loop"] = await async_bench_loop(ha, cams_sim, args)
+        finally:
+            if not args.keep:
+                for entry_id in entry_ids:
+                    await ha.async_rest("DELETE", "/api/config/config_entries/entry/" + entry_id)
+            await ha.async_close()
+            for runner in runners:
+                await runner.cleanup()
+
+    if cams_sim:
+        results["cam_requests"] = {
+            "max_concurrent": max(cam.max_active for cam in cams_sim),
+            "total": sum(sum(cam.requests.values()) for cam in cams_sim),
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arguments = parse_args()
+    if not arguments.token:
+        sys.exit("A long-lived access token is required (--token or HA_TOKEN)")
+
+    output = json.dumps(asyncio.run(async_main(arguments)), indent=2)
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,362 @@
+"""Fake yi-hack cams for offline testing and load benchmarks.
+
+Every simulated cam listens on its own port and serves the cgi-bin
+endpoints used by the integration. Optionally an mqtt publisher sends the
+birth, motion and motion image messages of every cam.
+
+Example: 200 cams on ports 8100-8299, 50ms latency, 1% errors
+    python tools/fake_cam.py --count 200 --base-port 8100 --latency 0.05 \
+        --failure-rate 0.01 --mqtt-host 127.0.0.1
+
+Requires aiohttp, and paho-mqtt for the mqtt publisher.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+from collections import Counter
+from dataclasses import dataclass, field
+import datetime as dt
+import json
+import logging
+import random
+
+from aiohttp import web
+
+_LOGGER = logging.getLogger("fake_cam")
+
+# 1x1 grey jpeg
+JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQEAYABgAAD/2wBDAAgGBgcGBQgHBwcJCQgKDBQNDAsLDBkSEw8UHRofHh0a"
+    "HBwgJC4nICIsIxwcKDcpLDAxNDQ0Hyc5PTgyPC4zNDL/wAALCAABAAEBAREA/8QAFAABAAAAAAAA"
+    "AAAAAAAAAAAACf/EABQQAQAAAAAAAAAAAAAAAAAAAAD/2gAIAQEAAD8AVN//2Q=="
+)
+
+MQTT_CONF = {
+    "TOPIC_BIRTH_WILL": "status",
+    "TOPIC_MOTION": "motion_detection",
+    "TOPIC_MOTION_IMAGE": "motion_detection_image",
+    "TOPIC_SOUND_DETECTION": "sound_detection",
+    "BIRTH_MSG": "online",
+    "WILL_MSG": "offline",
+    "MOTION_START_MSG": "motion_start",
+    "MOTION_STOP_MSG": "motion_stop",
+    "AI_HUMAN_DETECTION_MSG": "human",
+    "AI_VEHICLE_DETECTION_MSG": "vehicle",
+    "AI_ANIMAL_DETECTION_MSG": "animal",
+    "BABY_CRYING_MSG": "crying",
+    "SOUND_DETECTION_MSG": "sound_detected",
+}
+
+
+def padded_jpeg(size: int) -> bytes:
+    """Return a valid jpeg of about size bytes, padded with comments."""
+    padding = b""
+    missing = size - len(JPEG)
+    while missing > 4:
+        chunk = min(missing - 4, 65533)
+        padding += b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + b"\0" * chunk
+        missing -= chunk + 4
+
+    return JPEG[:2] + padding + JPEG[2:]
+
+
+@dataclass
+class FakeCam:
+    """State of a simulated cam."""
+
+    index: int
+    port: int
+    args: argparse.Namespace
+    requests: Counter = field(default_factory=Counter)
+    active: int = 0
+    max_active: int = 0
+
+    @property
+    def mac(self) -> str:
+        """Return the mac address of the cam."""
+        return "02:00:00:00:%02x:%02x" % (self.index // 256, self.index % 256)
+
+    @property
+    def mqtt_prefix(self) -> str:
+        """Return the mqtt prefix of the cam."""
+        return self.args.mqtt_prefix + str(self.index)
+
+    def event_dirs(self) -> list[str]:
+        """Return the hour directories, newest first."""
+        now = dt.datetime.now().replace(minute=0, second=0, microsecond=0)
+        return [
+            (now - dt.timedelta(hours=hour)).strftime("%YY%mM%dD%HH")
+            for hour in range(self.args.dirs)
+        ]
+
+
+@web.middleware
+async def simulate(request: web.Request, handler):
+    """Add latency and failures, and count the requests."""
+    cam: FakeCam = request.app["cam"]
+    args = cam.args
+    cam.requests[request.path] += 1
+    cam.active += 1
+    cam.max_active = max(cam.max_active, cam.active)
+    try:
+        await asyncio.sleep(args.latency + random.uniform(0, args.jitter))
+        if random.random() < args.hang_rate:
+            await asyncio.sleep(3600)
+        if random.random() < args.failure_rate:
+            raise web.HTTPInternalServerError()
+        return await handler(request)
+    finally:
+        cam.active -= 1
+
+
+def json_response(data) -> web.Response:
+    """Return json with the content type of the cam httpd."""
+    return web.Response(text=json.dumps(data), content_type="application/json")
+
+
+async def status(request: web.Request) -> web.Response:
+    """Serve /cgi-bin/status.json."""
+    cam: FakeCam = request.app["cam"]
+    return json_response({
+        "name": cam.args.hack_name,
+        "hostname": "fake" + str(cam.index),
+        "fw_version": "0.0.0",
+        "serial_number": "FAKE%08d" % cam.index,
+        "mac_addr": cam.mac,
+        "ptz": "yes",
+        "uptime": "0",
+    })
+
+
+async def get_configs(request: web.Request) -> web.Response:
+    """Serve /cgi-bin/get_configs.sh."""
+    cam: FakeCam = request.app["cam"]
+    conf = request.query.get("conf")
+    if conf == "system":
+        return json_response({"RTSP_PORT": "554", "HTTPD_PORT": str(cam.port)})
+    if conf == "mqtt":
+        return json_response({"MQTT_PREFIX": cam.mqtt_prefix, **MQTT_CONF})
+    return json_response({})
+
+
+async def links(request: web.Request) -> web.Response:
+    """Serve /cgi-bin/links.sh."""
+    host = request.host.split(":")[0]
+    return json_response({
+        "low_res_stream": "rtsp://" + host + "/ch0_1.h264",
+        "high_res_stream": "rtsp://" + host + "/ch0_0.h264",
+    })
+
+
+async def snapshot(request: web.Request) -> web.Response:
+    """Serve /cgi-bin/snapshot.sh."""
+    return web.Response(body=request.app["snapshot"], content_type="image/jpeg")
+
+
+async def eventsdir(request: web.Request) -> web.Response:
+    """Serve /cgi-bin/eventsdir.sh."""
+    cam: FakeCam = request.app["cam"]
+    records = []
+    for dirname in cam.event_dirs():
+        hour = dt.datetime.strptime(dirname, "%YY%mM%dD%HH")
+        records.append({
+            "dirname": dirname,
+            "datetime": hour.strftime("Date: %Y-%m-%d Time: %H:%M"),
+        })
+    return json_response({"records": records})
+
+
+async def eventsfile(request: web.Request) -> web.Response:
+    """Serve /cgi-bin/eventsfile.sh."""
+    cam: FakeCam = request.app["cam"]
+    dirname = request.query.get("dirname", "")
+    try:
+        hour = dt.datetime.strptime(dirname, "%YY%mM%dD%HH").hour
+    except ValueError:
+        return json_response({"records": []})
+
+    records = []
+    for index in range(cam.args.files):
+        minute = index * 60 // cam.args.files
+        records.append({
+            "time": "Time: %02d:%02d" % (hour, minute),
+            "filename": "%02dM00S60.mp4" % minute,
+            "thumbfilename": "%02dM00S60.jpg" % minute,
+        })
+    return json_response({"records": records})
+
+
+async def command(request: web.Request) -> web.Response:
+    """Serve ptz.sh, preset.sh, speak.sh, speaker.sh and reboot.sh."""
+    await request.read()
+    return json_response({"error": "false"})
+
+
+async def record(request: web.Request) -> web.StreamResponse:
+    """Serve the files of the recordings."""
+    if request.match_info["file"].endswith(".jpg"):
+        return web.Response(body=request.app["snapshot"], content_type="image/jpeg")
+
+    size = request.app["cam"].args.record_size
+    response = web.StreamResponse(headers={"Content-Length": str(size)})
+    response.content_type = "video/mp4"
+    await response.prepare(request)
+    chunk = b"\0" * 65536
+    while size > 0:
+        await response.write(chunk[:size])
+        size -= len(chunk)
+    await response.write_eof()
+    return response
+
+
+async def stats(request: web.Request) -> web.Response:
+    """Serve the request counters of the cam."""
+    cam: FakeCam = request.app["cam"]
+    return json_response({
+        "requests": dict(cam.requests),
+        "active": cam.active,
+        "max_active": cam.max_active,
+    })
+
+
+def create_app(cam: FakeCam) -> web.Application:
+    """Create the web application of a cam."""
+    app = web.Application(middlewares=[simulate])
+    app["cam"] = cam
+    app["snapshot"] = padded_jpeg(cam.args.snapshot_size)
+    app.router.add_get("/cgi-bin/status.json", status)
+    app.router.add_get("/cgi-bin/get_configs.sh", get_configs)
+    app.router.add_get("/cgi-bin/links.sh", links)
+    app.router.add_get("/cgi-bin/snapshot.sh", snapshot)
+    app.router.add_route("*", "/cgi-bin/eventsdir.sh", eventsdir)
+    app.router.add_route("*", "/cgi-bin/eventsfile.sh", eventsfile)
+    for script in ("ptz.sh", "preset.sh", "speak.sh", "speaker.sh", "reboot.sh"):
+        app.router.add_route("*", "/cgi-bin/" + script, command)
+    app.router.add_get("/record/{dir}/{file}", record)
+    app.router.add_get("/alarm_record/{path:.*}/{file}", record)
+    app.router.add_get("/stats.json", stats)
+    return app
+
+
+class MqttPublisher:
+    """Publish the mqtt messages of the fake cams."""
+
+    def __init__(self, args: argparse.Namespace, cams: list[FakeCam]) -> None:
+        """Connect to the broker."""
+        import paho.mqtt.client as mqtt
+
+        try:
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            self._client = mqtt.Client()
+        if args.mqtt_username:
+            self._client.username_pw_set(args.mqtt_username, args.mqtt_password)
+        self._client.connect(args.mqtt_host, args.mqtt_port)
+        self._client.loop_start()
+        self._args = args
+        self._cams = cams
+        self.published = 0
+
+    def publish(self, topic: str, payload, retain: bool = False) -> None:
+        """Publish a message."""
+        self._client.publish(topic, payload, qos=1, retain=retain)
+        self.published += 1
+
+    async def async_run(self) -> None:
+        """Send birth messages, then motion events forever."""
+        for cam in self._cams:
+            self.publish(cam.mqtt_prefix + "/" + MQTT_CONF["TOPIC_BIRTH_WILL"], MQTT_CONF["BIRTH_MSG"], retain=True)
+
+        image = padded_jpeg(self._args.snapshot_size)
+        while True:
+            # Spread the events of all the cams over the interval
+            for cam in self._cams:
+                await asyncio.sleep(self._args.motion_interval / len(self._cams))
+                prefix = cam.mqtt_prefix + "/"
+                self.publish(prefix + MQTT_CONF["TOPIC_MOTION"], MQTT_CONF["MOTION_START_MSG"])
+                self.publish(prefix + MQTT_CONF["TOPIC_MOTION_IMAGE"], image)
+                asyncio.get_running_loop().call_later(
+                    self._args.motion_duration,
+                    self.publish,
+                    prefix + MQTT_CONF["TOPIC_MOTION"],
+                    MQTT_CONF["MOTION_STOP_MSG"],
+                )
+
+    def stop(self, send_will: bool = True) -> None:
+        """Send will messages and disconnect."""
+        for cam in self._cams if send_will else []:
+            self.publish(cam.mqtt_prefix + "/" + MQTT_CONF["TOPIC_BIRTH_WILL"], MQTT_CONF["WILL_MSG"], retain=True)
+        self._client.loop_stop()
+        self._client.disconnect()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1, help="number of cams")
+    parser.add_argument("--bind", default="127.0.0.1", help="listen address")
+    parser.add_argument("--base-port", type=int, default=8100, help="port of the first cam")
+    parser.add_argument("--hack-name", default="yi-hack-allwinner-v2", help="hack name reported by status.json")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random seconds added to the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a 500 response")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="probability of a request that never answers")
+    parser.add_argument("--dirs", type=int, default=24, help="hour directories in eventsdir.sh")
+    parser.add_argument("--files", type=int, default=10, help="recordings in every directory")
+    parser.add_argument("--snapshot-size", type=int, default=100000, help="bytes of snapshots and thumbnails")
+    parser.add_argument("--record-size", type=int, default=2000000, help="bytes of every recording")
+    parser.add_argument("--mqtt-host", help="broker for the mqtt publisher, disabled if missing")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--mqtt-username")
+    parser.add_argument("--mqtt-password")
+    parser.add_argument("--mqtt-prefix", default="yicam", help="prefix, the cam index is appended")
+    parser.add_argument("--motion-interval", type=float, default=60.0, help="seconds between the events of a cam")
+    parser.add_argument("--motion-duration", type=float, default=10.0, help="seconds before motion stop")
+    return parser.parse_args(argv)
+
+
+async def async_start(args: argparse.Namespace) -> tuple[list[FakeCam], list[web.AppRunner]]:
+    """Start the web servers of the fake cams."""
+    cams = []
+    runners = []
+    for index in range(args.count):
+        cam = FakeCam(index, args.base_port + index, args)
+        runner = web.AppRunner(create_app(cam), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, args.bind, cam.port).start()
+        cams.append(cam)
+        runners.append(runner)
+
+    return cams, runners
+
+
+async def async_main(args: argparse.Namespace) -> None:
+    """Run the fake cams until interrupted."""
+    cams, runners = await async_start(args)
+    _LOGGER.info("%s cams listening on %s:%s-%s", len(cams), args.bind, args.base_port, args.base_port + args.count - 1)
+
+    publisher = None
+    if args.mqtt_host:
+        publisher = MqttPublisher(args, cams)
+    try:
+        if publisher is not None:
+            await publisher.async_run()
+        else:
+            await asyncio.Event().wait()
+    finally:
+        if publisher is not None:
+            publisher.stop()
+        for runner in runners:
+            await runner.cleanup()
+        total = sum((cam.requests for cam in cams), Counter())
+        _LOGGER.info("Requests served: %s", dict(total))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(async_main(parse_args()))
+    except KeyboardInterrupt:
+        pass